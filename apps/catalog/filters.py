@@ -1,20 +1,25 @@
+from django.template.defaultfilters import slugify
+
+from .search import search
+
+
 def filter_items(qs, data):
 	pk = data.get('pk', '')
-	item_type = data.get('type', '')
-	item_category = data.get('category', '')
-	item = data.get('item', '')
+	item_type = slugify(data.get('type', ''))
+	item_category = slugify(data.get('category', ''))
+	item = slugify(data.get('item', ''))
+	query = data.get('q', '')
 
 	if pk:
-		qs = qs.filter(pk=pk)
-	else:
-		qs = qs.filter(
-			item_type__slug__icontains=item_type,
-			item_category__slug__icontains=item_category,
-			slug__icontains=item
-		).exclude(
-			item_type__slug__iexact='',
-			item_category__slug__iexact='',
-			slug__iexact=''
-		)
+		return qs.filter(pk=pk)
+
+	if item_type:
+		qs = qs.filter(item_type__slug=item_type)
+	if item_category:
+		qs = qs.filter(item_category__slug=item_category)
+	if item:
+		qs = qs.filter(slug=item)
 
-	return qs.order_by('item_type__name', 'item_category__name', 'name')
\ No newline at end of file
+	if query:
+		return search(qs, query)
+	return qs.exclude(slug='').order_by('item_type__name', 'item_category__name', 'name')
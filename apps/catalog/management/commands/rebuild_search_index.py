@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from catalog.models import INDEX_BATCH_SIZE, Item, SearchTerm, index_items
+
+
+class Command(BaseCommand):
+	help = "Rebuilds the catalog search terms of every item."
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=INDEX_BATCH_SIZE)
+
+	def handle(self, *args, **options):
+		item_ids = list(Item.objects.values_list('pk', flat=True))
+		index_items(item_ids, batch_size=options['batch_size'])
+		self.stdout.write(self.style.SUCCESS(
+			f"Indexed {SearchTerm.objects.count()} term(s) for {len(item_ids)} item(s)."
+		))
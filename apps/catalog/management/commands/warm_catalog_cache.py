@@ -0,0 +1,49 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIClient
+
+from catalog.models import ItemCategory, ItemType
+from common.utils import cache_is_shared
+
+
+class Command(BaseCommand):
+	help = "Pre-renders the catalog and store listings for the common filter combinations."
+
+	def add_arguments(self, parser):
+		hosts = [host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*']
+		parser.add_argument('--host', default=hosts[0] if hosts else 'localhost', help="Host (and port) clients request.")
+		parser.add_argument('--path', action='append', default=[], help="Extra path to render, e.g. /catalog/?q=shoe")
+
+	def get_paths(self, options):
+		prefixes = ['/catalog/'] + (['/store/'] if apps.is_installed('store') else [])
+		item_types = list(ItemType.objects.filter(is_active=True).values_list('slug', flat=True))
+		categories = list(ItemCategory.objects.filter(is_active=True).values_list('slug', flat=True))
+
+		queries = ['']
+		queries += [f'?type={item_type}' for item_type in item_types]
+		queries += [f'?category={category}' for category in categories]
+		queries += [f'?type={item_type}&category={category}' for item_type in item_types for category in categories]
+		return [prefix + query for prefix in prefixes for query in queries] + options['path']
+
+	# Each path goes through the full request stack, so the view caches it
+	# under the same get_cache_key a client's request for it would hit.
+	def handle(self, *args, **options):
+		if not cache_is_shared():
+			raise CommandError(
+				"The default cache is local to each process, so the workers wouldn't see the warmed listings. "
+				"Point CACHES at a shared backend, or set CACHE_IS_SHARED for a single process."
+			)
+
+		client = APIClient()
+		client.force_authenticate(apps.get_model(settings.AUTH_USER_MODEL)(email='warmup@localhost'))
+
+		warmed = 0
+		for path in self.get_paths(options):
+			response = client.get(path, HTTP_HOST=options['host'])
+			if response.status_code == 200 and response.has_header('ETag'):
+				warmed += 1
+			else:
+				self.stdout.write(self.style.WARNING(f"{path}: {response.status_code}, not cached"))
+
+		self.stdout.write(self.style.SUCCESS(f"Warmed {warmed} listing(s)."))
@@ -1,7 +1,17 @@
-from django.db import models
+import re
+
+from django.db import models, transaction
 from django.core.exceptions import ValidationError
+from django.db.models import Max
+from django.db.models.functions import Cast
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.template.defaultfilters import slugify
 
+from common.models import Sequence, SequenceAllocator
+from common.signals import post_batch_delete, post_bulk_create, post_bulk_update
+from common.utils import CacheVersion
+
 
 class ItemType(models.Model):
 	name = models.CharField(max_length=30, unique=True)
@@ -42,6 +52,12 @@ class Parcel(models.Model):
 		return f"{self.length}x{self.width}x{self.height}: {self.weight}"
 
 
+item_numbers = SequenceAllocator(
+	'catalog.item',
+	initial=lambda: Item.objects.aggregate(number=Max(Cast('number', models.IntegerField())))['number'] or 0
+)
+
+
 class Item(models.Model):
 	item_type = models.ForeignKey(ItemType, on_delete=models.CASCADE)
 	item_category = models.ForeignKey(ItemCategory, on_delete=models.CASCADE)
@@ -70,12 +86,34 @@ class Item(models.Model):
 		return self.name
 
 	def set_number(self):
-		last_number = 0
-		qs = Item.objects.all()
-		if qs.count() > 0:
-			last_number = list(qs.order_by('-number').values('number'))[0]['number']
-		
-		self.number = int(last_number) + 1
+		self.number = item_numbers.next()
+
+	@classmethod
+	def set_numbers(cls, items):
+		for item, number in zip(items, item_numbers.take(len(items))):
+			item.number = number
+
+	@classmethod
+	def prepare_bulk(cls, items):
+		cls.set_numbers(items)
+		for item in items:
+			item.slug = slugify(item.name)
+
+	@classmethod
+	def set_bulk_pks(cls, items, batch_size=500):
+		# bulk_create fills in pks on backends that return them; otherwise match
+		# the rows up by the unique_together key
+		items = [item for item in items if item.pk is None]
+		for i in range(0, len(items), batch_size):
+			batch = {(item.item_type_id, item.item_category_id, item.name): item for item in items[i:i+batch_size]}
+			qs = Item.objects.filter(
+				name__in={key[2] for key in batch},
+				item_type__in={key[0] for key in batch},
+				item_category__in={key[1] for key in batch}
+			)
+			for pk, *key in qs.values_list('pk', 'item_type_id', 'item_category_id', 'name'):
+				if tuple(key) in batch:
+					batch[tuple(key)].pk = pk
 
 	def save(self, *args, **kwargs):
 		if self.pk is None:
@@ -96,15 +134,114 @@ class Image(models.Model):
 		return f"Image: {self.item.name}"
 
 	def set_number(self):
-		last_number = 0
-		qs = Image.objects.filter(item=self.item)
-		if qs.count() > 0:
-			last_number = list(qs.order_by('-number').values('number'))[0]['number']
-		
-		self.number = int(last_number) + 1
+		Image.set_numbers([self])
+
+	@classmethod
+	def set_numbers(cls, images):
+		by_item = {}
+		for image in images:
+			by_item.setdefault(image.item_id, []).append(image)
+
+		for item_id, item_images in by_item.items():
+			numbers = Sequence.objects.allocate(
+				f'catalog.image.{item_id}',
+				len(item_images),
+				initial=lambda: Image.objects.filter(item_id=item_id).aggregate(Max('number'))['number__max'] or 0
+			)
+			for image, number in zip(item_images, numbers):
+				image.number = number
 
 	def save(self, *args, **kwargs):
 		if self.pk is None:
 			self.set_number()
 
-		super().save(*args, **kwargs)
\ No newline at end of file
+		super().save(*args, **kwargs)
+
+
+# Search index
+# One row per distinct term of an item's name, description, type and category,
+# kept in sync by the receivers below. See catalog.search.
+class SearchTerm(models.Model):
+	item = models.ForeignKey(Item, related_name='search_terms', on_delete=models.CASCADE)
+	term = models.CharField(max_length=60, db_index=True)
+	weight = models.PositiveSmallIntegerField(default=1)
+
+	class Meta:
+		unique_together = ('item', 'term')
+
+	def __str__(self):
+		return f"{self.term} ({self.weight})"
+
+
+INDEXED_FIELDS = {'name', 'description', 'item_type', 'item_category'}
+TERM_WEIGHTS = (('name', 3), ('item_type__name', 2), ('item_category__name', 2), ('description', 1))
+INDEX_BATCH_SIZE = 500
+
+
+def tokenize(text):
+	return [term[:60] for term in re.findall(r'\w+', (text or '').lower())]
+
+
+# Rebuilds the terms of the given items: one read, one delete and one insert
+# per batch.
+def index_items(item_ids, batch_size=INDEX_BATCH_SIZE):
+	item_ids = list(item_ids)
+	lookups = [lookup for lookup, weight in TERM_WEIGHTS]
+
+	with transaction.atomic():
+		for i in range(0, len(item_ids), batch_size):
+			batch = item_ids[i:i+batch_size]
+			terms = []
+			for pk, *values in Item.objects.filter(pk__in=batch).values_list('pk', *lookups):
+				weights = {}
+				for value, (lookup, weight) in zip(values, TERM_WEIGHTS):
+					for term in tokenize(value):
+						weights[term] = max(weights.get(term, 0), weight)
+				terms += [SearchTerm(item_id=pk, term=term, weight=weight) for term, weight in weights.items()]
+
+			SearchTerm.objects.filter(item_id__in=batch).delete()
+			SearchTerm.objects.bulk_create(terms, batch_size=batch_size)
+
+
+# Bumped whenever anything shown in the catalog or store listings changes
+catalog_version = CacheVersion('catalog')
+
+
+# Signals
+@receiver(post_save, sender=Item, dispatch_uid="item_saved_catalog_version")
+@receiver(post_delete, sender=Item, dispatch_uid="item_deleted_catalog_version")
+@receiver(post_save, sender=ItemType, dispatch_uid="item_type_saved_catalog_version")
+@receiver(post_delete, sender=ItemType, dispatch_uid="item_type_deleted_catalog_version")
+@receiver(post_save, sender=ItemCategory, dispatch_uid="item_category_saved_catalog_version")
+@receiver(post_delete, sender=ItemCategory, dispatch_uid="item_category_deleted_catalog_version")
+@receiver(post_save, sender=Parcel, dispatch_uid="parcel_saved_catalog_version")
+@receiver(post_delete, sender=Parcel, dispatch_uid="parcel_deleted_catalog_version")
+@receiver(post_bulk_create, sender=Item, dispatch_uid="items_bulk_created_catalog_version")
+@receiver(post_bulk_update, sender=Item, dispatch_uid="items_bulk_updated_catalog_version")
+@receiver(post_batch_delete, dispatch_uid="batch_deleted_catalog_version")
+def bump_catalog_version(sender, **kwargs):
+	catalog_version.bump()
+
+
+@receiver(post_save, sender=Item, dispatch_uid="item_saved_index")
+def item_saved_index(sender, instance, **kwargs):
+	index_items([instance.pk])
+
+
+@receiver(post_bulk_create, sender=Item, dispatch_uid="items_bulk_created_index")
+def items_bulk_created_index(sender, instances, **kwargs):
+	index_items([item.pk for item in instances])
+
+
+@receiver(post_bulk_update, sender=Item, dispatch_uid="items_bulk_updated_index")
+def items_bulk_updated_index(sender, instances, fields, **kwargs):
+	if INDEXED_FIELDS.intersection(fields):
+		index_items([item.pk for item in instances])
+
+
+@receiver(post_save, sender=ItemType, dispatch_uid="item_type_saved_index")
+@receiver(post_save, sender=ItemCategory, dispatch_uid="item_category_saved_index")
+def item_group_saved_index(sender, instance, created, **kwargs):
+	if not created:
+		field = 'item_type' if sender is ItemType else 'item_category'
+		index_items(Item.objects.filter(**{field: instance}).values_list('pk', flat=True))
@@ -0,0 +1,85 @@
+from difflib import get_close_matches
+from functools import reduce
+from math import ceil, floor
+from operator import add
+
+from django.db.models import Case, ExpressionWrapper, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Length
+
+from .models import SearchTerm, tokenize
+
+
+MAX_EXPANSIONS = 50
+FUZZY_CUTOFF = 0.75
+FUZZY_CANDIDATES = 1000
+
+# Scaled onto the term weight: an exact term beats a prefix, a prefix beats a typo
+EXACT, PREFIX, FUZZY = 3, 2, 1
+
+
+def prefix_range(token):
+	return {'term__gte': token, 'term__lt': token + '\uffff'}
+
+
+# Lengths a term can have and still reach FUZZY_CUTOFF against a token of the
+# given length; the ratio is at most 2 * shorter / (shorter + longer).
+def fuzzy_lengths(length):
+	return ceil(length * FUZZY_CUTOFF / (2 - FUZZY_CUTOFF)), floor(length * (2 - FUZZY_CUTOFF) / FUZZY_CUTOFF)
+
+
+# Terms a query token can stand for, with how well each one matches. Prefixes
+# are an index range scan. A token without any prefix match falls back to the
+# closest terms that share its first letter, out of at most FUZZY_CANDIDATES of
+# a length that could match.
+def expand_token(token):
+	terms = list(
+		SearchTerm.objects.filter(**prefix_range(token))
+		.values_list('term', flat=True).distinct().order_by('term')[:MAX_EXPANSIONS]
+	)
+	if terms:
+		return {term: EXACT if term == token else PREFIX for term in terms}
+
+	candidates = (
+		SearchTerm.objects.filter(**prefix_range(token[0]))
+		.annotate(length=Length('term')).filter(length__range=fuzzy_lengths(len(token)))
+		.values_list('term', flat=True).distinct().order_by('term')[:FUZZY_CANDIDATES]
+	)
+	return {term: FUZZY for term in get_close_matches(token, list(candidates), n=5, cutoff=FUZZY_CUTOFF)}
+
+
+# Most queries search() runs before the filtered query itself
+def search_query_count(query):
+	return 2 * len(set(tokenize(query)))
+
+
+# The item's best score for one token, or NULL when none of its terms match
+def token_score(token, expansion, item_field):
+	factor = Case(When(term=token, then=Value(EXACT)), default=Value(min(expansion.values())))
+	best = (
+		SearchTerm.objects.filter(item=OuterRef(item_field), term__in=list(expansion))
+		.annotate(score=ExpressionWrapper(F('weight') * factor, output_field=IntegerField()))
+		.order_by('-score').values('score')[:1]
+	)
+	return Subquery(best, output_field=IntegerField())
+
+
+# Filters qs (of items, or of rows related to items through `item_field`) down
+# to the rows whose item matches every token of query and orders them by
+# relevance. The scores are computed in the same query, so filters already on
+# qs apply before ranking and pagination limits the ranked rows.
+def search(qs, query, item_field='pk'):
+	tokens = list(dict.fromkeys(tokenize(query)))
+	expansions = [expand_token(token) for token in tokens]
+	if not tokens or not all(expansions):
+		return qs.none()
+
+	scores = {
+		f'search_{i}': token_score(token, expansion, item_field)
+		for i, (token, expansion) in enumerate(zip(tokens, expansions))
+	}
+	return (
+		qs.annotate(**scores)
+		.filter(**{f'{name}__isnull': False for name in scores})
+		.annotate(rank=reduce(add, (F(name) for name in scores)))
+		.order_by('-rank', 'pk')
+	)
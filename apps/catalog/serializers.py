@@ -1,6 +1,9 @@
 from django.apps import apps
+from django.template.defaultfilters import slugify
 from rest_framework import serializers
 
+from common.serializers import BulkMixin
+
 from .models import *
 
 
@@ -10,7 +13,7 @@ class ParcelSerializer(serializers.ModelSerializer):
 		fields = '__all__'
 
 
-class ItemSerializer(serializers.ModelSerializer):
+class ItemSerializer(BulkMixin, serializers.ModelSerializer):
 	item_type = serializers.CharField()
 	item_category = serializers.CharField()
 	parcel = ParcelSerializer()
@@ -20,6 +23,8 @@ class ItemSerializer(serializers.ModelSerializer):
 		fields = ['item_type', 'item_category', 'name', 'slug', 'description', 'number', 'is_active', 'parcel']
 
 		depth = 1
+		select_related = ('item_type', 'item_category')
+		values_lookups = {'item_type': 'item_type__name', 'item_category': 'item_category__name'}
 		extra_kwargs = {
 			'description': {'required': False},
 			'is_active': {'required': False},
@@ -28,17 +33,30 @@ class ItemSerializer(serializers.ModelSerializer):
 		}
 
 	def validate_item_type(self, value):
-		return ItemType.objects.get_or_create(name=value)[0]
+		return self.get_or_create_cached(ItemType, name=value)
 
 	def validate_item_category(self, value):
-		return ItemCategory.objects.get_or_create(name=value)[0]
+		return self.get_or_create_cached(ItemCategory, name=value)
 
 	def validate_parcel(self, value):
 		value = dict(value)
-		parcel = Parcel.objects.get_or_create(
+		parcel = self.get_or_create_cached(
+			Parcel,
 			length=value['length'],
 			width=value['width'],
 			height=value['height'],
 			weight=value['weight']
-		)[0]
-		return parcel
\ No newline at end of file
+		)
+		return parcel
+
+	def before_bulk_create(self, items):
+		Item.prepare_bulk(items)
+
+	def after_bulk_create(self, items):
+		Item.set_bulk_pks(items)
+
+	def before_bulk_update(self, item, fields):
+		if 'name' in fields:
+			item.slug = slugify(item.name)
+			fields.add('slug')
+		return fields
\ No newline at end of file
@@ -0,0 +1,102 @@
+from difflib import SequenceMatcher
+
+from django.test import TestCase
+
+from model_bakery import baker
+
+from catalog.models import Image, Item, ItemType, SearchTerm
+from catalog.search import FUZZY_CUTOFF, fuzzy_lengths, search
+
+
+class ItemNumberTests(TestCase):
+	def test_numbers_are_numeric_past_nine(self):
+		items = baker.make('catalog.Item', _quantity=11)
+		numbers = sorted(int(item.number) for item in Item.objects.filter(pk__in=[i.pk for i in items]))
+		self.assertEqual(numbers, list(range(1, 12)))
+
+	def test_continues_after_existing_numbers(self):
+		item = baker.prepare('catalog.Item', _save_related=True, number='10')
+		Item.objects.bulk_create([item])
+
+		self.assertEqual(baker.make('catalog.Item').number, 11)
+
+	def test_set_numbers_allocates_a_batch(self):
+		Item.set_numbers(baker.prepare('catalog.Item', _quantity=1))
+
+		items = baker.prepare('catalog.Item', _quantity=5)
+		with self.assertNumQueries(4):
+			Item.set_numbers(items)
+		self.assertEqual([item.number for item in items], [2, 3, 4, 5, 6])
+
+	def test_set_bulk_pks_matches_by_natural_key(self):
+		baker.make('catalog.Item', number='LEGACY-1')
+		item_type, item_category = baker.make('catalog.ItemType'), baker.make('catalog.ItemCategory')
+		items = baker.prepare(
+			'catalog.Item', item_type=item_type, item_category=item_category, _save_related=True, _quantity=3
+		)
+		Item.prepare_bulk(items)
+		Item.objects.bulk_create(items)
+		Item.set_bulk_pks(items)
+
+		self.assertEqual([Item.objects.get(pk=item.pk).name for item in items], [item.name for item in items])
+
+
+class ImageNumberTests(TestCase):
+	def test_numbers_are_per_item(self):
+		items = baker.make('catalog.Item', _quantity=2)
+		first = Image.objects.create(item=items[0])
+		second = Image.objects.create(item=items[0])
+		other = Image.objects.create(item=items[1])
+
+		self.assertEqual([first.number, second.number, other.number], [1, 2, 1])
+
+	def test_set_numbers_groups_by_item(self):
+		item = baker.make('catalog.Item')
+		Image.objects.create(item=item)
+
+		images = [Image(item=item) for i in range(3)]
+		Image.set_numbers(images)
+		self.assertEqual([image.number for image in images], [2, 3, 4])
+
+
+class SearchTests(TestCase):
+	def setUp(self):
+		shoes = baker.make('catalog.ItemType', name='Shoes')
+		hats = baker.make('catalog.ItemType', name='Hats')
+		self.runner = baker.make('catalog.Item', name='Trail Runner', description='Light shoe for trails', item_type=shoes)
+		self.racer = baker.make('catalog.Item', name='Road Racer', description='Runs fast', item_type=shoes)
+		self.hat = baker.make('catalog.Item', name='Wool Hat', description=None, item_type=hats)
+
+	def search(self, query):
+		return list(search(Item.objects.all(), query).values_list('pk', flat=True))
+
+	def test_saves_index_terms(self):
+		terms = set(SearchTerm.objects.filter(item=self.runner).values_list('term', flat=True))
+		self.assertTrue({'trail', 'runner', 'light', 'shoes'} <= terms)
+
+		self.runner.name = 'Summit Runner'
+		self.runner.save()
+		self.assertEqual(self.search('trail'), [self.runner.pk])
+		self.assertEqual(self.search('summit'), [self.runner.pk])
+
+	def test_prefix_and_ranking(self):
+		# The name match outranks the description match
+		self.assertEqual(self.search('run'), [self.runner.pk, self.racer.pk])
+		self.assertEqual(self.search('shoe trail'), [self.runner.pk])
+
+	def test_typos(self):
+		self.assertEqual(self.search('wol'), [self.hat.pk])
+		self.assertEqual(self.search('raccer'), [self.racer.pk])
+
+	def test_fuzzy_length_window_keeps_every_possible_match(self):
+		for length in range(1, 30):
+			low, high = fuzzy_lengths(length)
+			for other in range(1, 60):
+				ratio = SequenceMatcher(None, 'a' * length, 'a' * other).ratio()
+				self.assertEqual(low <= other <= high, ratio >= FUZZY_CUTOFF, (length, other))
+
+	def test_type_rename_reindexes_items(self):
+		item_type = ItemType.objects.get(name='Hats')
+		item_type.name = 'Caps'
+		item_type.save()
+		self.assertEqual(self.search('caps'), [self.hat.pk])
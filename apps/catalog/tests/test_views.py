@@ -0,0 +1,277 @@
+import json
+from base64 import urlsafe_b64encode
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework import serializers, status
+from rest_framework.test import APIClient
+
+from model_bakery import baker
+
+from catalog.models import Item, ItemType
+from catalog.serializers import ItemSerializer
+from common.serializers import ValuesSerializer
+from common.utils import CompactJsonRenderer
+from store.models import Price, PriceLevel
+from .utils import getItemData
+
+
+class ItemBulkViewTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.client.force_authenticate(baker.make('users.User', email='ryu@email.com'))
+		PriceLevel.objects.create(name='Retail')
+
+	def post(self, data):
+		return self.client.post('/catalog/', data=data, format='json')
+
+	def count_post_queries(self, data):
+		with CaptureQueriesContext(connection) as context:
+			response = self.post(data)
+		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+		return len(context)
+
+	def test_bulk_create(self):
+		data = [getItemData(f'Shoe {i}') for i in range(3)] + [getItemData('Hat', item_type='Hats')]
+		response = self.post(data)
+
+		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+		self.assertEqual([item['number'] for item in response.data], ['1', '2', '3', '4'])
+		self.assertEqual(ItemType.objects.count(), 2)
+		self.assertEqual(Item.objects.get(name='Hat').slug, 'hat')
+		self.assertEqual(Price.objects.count(), 4)
+
+	def test_query_count_is_independent_of_batch_size(self):
+		self.post([getItemData('First')])
+		small = self.count_post_queries([getItemData(f'Small {i}') for i in range(2)])
+		large = self.count_post_queries([getItemData(f'Large {i}') for i in range(20)])
+		self.assertEqual(small, large)
+
+	def test_duplicate_rows_are_rejected(self):
+		self.post([getItemData('Shoe')])
+		response = self.post([getItemData('Boot'), getItemData('Shoe')])
+
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		self.assertIn("position '1'", str(response.data))
+		self.assertEqual(Item.objects.count(), 1)
+
+	def test_conflicts_after_validation_are_reported_by_position(self):
+		self.post([getItemData('Shoe')])
+		with mock.patch('common.serializers.validate_unique_together', return_value={}):
+			response = self.post([getItemData('Boot'), getItemData('Shoe')])
+
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		self.assertEqual(response.data, ["Dictionary instance at position '1' conflicts with an existing row"])
+		self.assertEqual(Item.objects.count(), 1)
+
+
+class ItemBulkUpdateTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.client.force_authenticate(baker.make('users.User', email='ryu@email.com'))
+		self.client.post('/catalog/', data=[getItemData(f'Shoe {i}') for i in range(25)], format='json')
+		self.items = list(Item.objects.order_by('pk'))
+
+	def patch(self, items):
+		data = [dict(getItemData(name), id=item.pk) for item, name in items]
+		return self.client.patch('/catalog/', data=data, format='json')
+
+	def test_bulk_update(self):
+		response = self.patch([(self.items[0], 'Boot'), (self.items[1], self.items[1].name)])
+
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual([item['name'] for item in response.data], ['Boot', 'Shoe 1'])
+		self.assertEqual(Item.objects.get(pk=self.items[0].pk).slug, 'boot')
+
+	def test_errors_are_reported_by_position(self):
+		response = self.patch([(self.items[0], 'Boot'), (self.items[1], 'Shoe 2'), (self.items[2], '')])
+
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		self.assertEqual(sorted(response.data['data']), [1, 2])
+		self.assertEqual(Item.objects.filter(name='Boot').count(), 0)
+
+	def test_query_count_is_independent_of_batch_size(self):
+		def count(items):
+			with CaptureQueriesContext(connection) as context:
+				self.assertEqual(self.patch(items).status_code, status.HTTP_200_OK)
+			return len(context)
+
+		small = count([(item, f'Small {i}') for i, item in enumerate(self.items[:2])])
+		large = count([(item, f'Large {i}') for i, item in enumerate(self.items[2:22])])
+		self.assertEqual(small, large)
+
+
+class ItemListPaginationTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.client.force_authenticate(baker.make('users.User', email='ryu@email.com'))
+		data = [getItemData(f'Shoe {i:02}') for i in range(15)]
+		data += [getItemData(f'Hat {i:02}', item_type='Hats') for i in range(10)]
+		self.client.post('/catalog/', data=data, format='json')
+
+	def get_pages(self, url):
+		pages = []
+		while url:
+			with CaptureQueriesContext(connection) as context:
+				response = self.client.get(url)
+			self.assertEqual(response.status_code, status.HTTP_200_OK)
+			pages.append((response.data['results'], len(context)))
+			url = response.data['next']
+		return pages
+
+	def test_pages_follow_filter_ordering(self):
+		pages = self.get_pages('/catalog/?page_size=10')
+		names = [item['name'] for results, queries in pages for item in results]
+
+		self.assertEqual([len(results) for results, queries in pages], [10, 10, 5])
+		self.assertEqual(names, [f'Hat {i:02}' for i in range(10)] + [f'Shoe {i:02}' for i in range(15)])
+
+	def test_deep_pages_cost_the_same(self):
+		pages = self.get_pages('/catalog/?page_size=5')
+		self.assertEqual(len({queries for results, queries in pages}), 1)
+
+	def test_invalid_cursor(self):
+		response = self.client.get('/catalog/?cursor=bad')
+		self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_cursor_values_of_the_wrong_type(self):
+		for values in (['Hats', 'Casual', 'Hat 00', 'abc'], ['Hats', 'Casual', 'Hat 00', None], [1, 2, 3, {}]):
+			cursor = urlsafe_b64encode(json.dumps(values).encode()).decode()
+			response = self.client.get(f'/catalog/?cursor={cursor}')
+			self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_other_lists_are_not_paginated(self):
+		response = self.client.get('/customers/address/')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data, [])
+
+
+class ItemListRenderingTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.client.force_authenticate(baker.make('users.User', email='ryu@email.com'))
+		self.client.post('/catalog/', data=[getItemData(f'Shoe {i:02}') for i in range(12)], format='json')
+
+	def test_compact_by_default(self):
+		response = self.client.get('/catalog/')
+		self.assertNotIn(b'\n', response.content)
+		self.assertIn(b'\n  ', self.client.get('/catalog/?format=pretty').content)
+
+	def test_values_output_matches_serializer(self):
+		Item.objects.filter(name='Shoe 00').update(description=None)
+		qs = Item.objects.order_by('pk')
+		serializer = ValuesSerializer.for_serializer(ItemSerializer)
+
+		renderer = CompactJsonRenderer()
+		fast = renderer.render([serializer.to_representation(row) for row in serializer.values(qs)])
+		self.assertEqual(fast, renderer.render(ItemSerializer(qs, many=True).data))
+
+	def test_values_rejects_fields_that_need_the_related_object(self):
+		class SlugItemSerializer(serializers.ModelSerializer):
+			item_type = serializers.SlugRelatedField(slug_field='slug', read_only=True)
+
+			class Meta:
+				model = Item
+				fields = ('name', 'item_type')
+
+		with self.assertRaises(ImproperlyConfigured):
+			ValuesSerializer(SlugItemSerializer)
+
+	def test_stream_returns_every_row(self):
+		response = self.client.get('/catalog/?format=stream')
+		self.assertTrue(response.streaming)
+
+		rows = json.loads(b''.join(response.streaming_content))
+		self.assertEqual([row['name'] for row in rows], [f'Shoe {i:02}' for i in range(12)])
+
+
+class ItemFilterTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.client.force_authenticate(baker.make('users.User', email='ryu@email.com'))
+		data = [getItemData('Trail Runner'), getItemData('Road Runner'), getItemData('Wool Hat', item_type='Hats')]
+		self.client.post('/catalog/', data=data, format='json')
+
+	def get_names(self, query):
+		return [item['name'] for item in self.client.get(f'/catalog/?{query}').data['results']]
+
+	def test_exact_slug_filters(self):
+		self.assertEqual(self.get_names('type=hats'), ['Wool Hat'])
+		self.assertEqual(self.get_names('type=Shoes&item=road-runner'), ['Road Runner'])
+		self.assertEqual(self.get_names('type=sho'), [])
+
+	def test_search_orders_by_relevance(self):
+		self.assertEqual(self.get_names('q=runner+trail'), ['Trail Runner'])
+		self.assertEqual(self.get_names('q=runer'), ['Trail Runner', 'Road Runner'])
+		self.assertEqual(self.get_names('q=hat&type=shoes'), [])
+
+	def test_search_ranks_within_filters(self):
+		for i in range(5):
+			self.client.post('/catalog/', data=[getItemData(f'Runner {i}')], format='json')
+		self.assertEqual(self.get_names('q=runner&item=road-runner'), ['Road Runner'])
+
+	@override_settings(QUERY_BUDGET_RAISE=True)
+	def test_search_budget_grows_with_the_query(self):
+		self.assertEqual(self.get_names('q=trail+trai+runner+runer'), ['Trail Runner'])
+
+	def test_facets(self):
+		with self.assertNumQueries(2):
+			response = self.client.get('/catalog/?facets=1')
+
+		item_types = {entry['name']: entry['count'] for entry in response.data['item_type']}
+		self.assertEqual(item_types, {'Shoes': 2, 'Hats': 1})
+		self.assertEqual(response.data['in_stock'], [{'id': False, 'count': 3}])
+		self.assertEqual(response.data['location'], [])
+
+
+# A single test process shares its local-memory cache with itself
+@override_settings(CACHE_IS_SHARED=True)
+class ItemListCacheTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.client = APIClient()
+		self.client.force_authenticate(baker.make('users.User', email='ryu@email.com'))
+		self.client.post('/catalog/', data=[getItemData('Trail Runner'), getItemData('Wool Hat', item_type='Hats')], format='json')
+
+	def test_cached_and_conditional_gets_skip_the_database(self):
+		response = self.client.get('/catalog/')
+		etag = response['ETag']
+
+		with self.assertNumQueries(0):
+			cached = self.client.get('/catalog/')
+			not_modified = self.client.get('/catalog/', HTTP_IF_NONE_MATCH=etag)
+
+		self.assertEqual(cached.content, response.content)
+		self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+	def test_changes_bump_the_version(self):
+		etag = self.client.get('/catalog/')['ETag']
+		item = Item.objects.get(name='Wool Hat')
+		item.description = 'Warm'
+		item.save()
+
+		response = self.client.get('/catalog/', HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertNotEqual(response['ETag'], etag)
+
+	def test_warm_up(self):
+		call_command('warm_catalog_cache', host='testserver', stdout=StringIO())
+		with self.assertNumQueries(0):
+			response = self.client.get('/catalog/?type=hats')
+		self.assertEqual([item['name'] for item in response.json()['results']], ['Wool Hat'])
+
+	@override_settings(CACHE_IS_SHARED=None)
+	def test_per_process_cache_is_not_used(self):
+		self.client.get('/catalog/')
+		with self.assertNumQueries(1):
+			response = self.client.get('/catalog/')
+		self.assertFalse(response.has_header('ETag'))
+
+		with self.assertRaises(CommandError):
+			call_command('warm_catalog_cache', host='testserver', stdout=StringIO())
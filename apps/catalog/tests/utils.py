@@ -0,0 +1,8 @@
+def getItemData(name, item_type='Shoes', item_category='Running'):
+	return {
+		'item_type': item_type,
+		'item_category': item_category,
+		'name': name,
+		'description': f"{name} description",
+		'parcel': {'length': 10, 'width': 5, 'height': 4, 'weight': 1},
+	}
@@ -1,6 +1,11 @@
+from django.apps import apps
+from django.db.models import Count, Exists, F, OuterRef
+
+from common.utils import count_facets
 from common.views import BulkAPIView
 from .filters import filter_items
 from .models import *
+from .search import search_query_count
 from .serializers import *
 
 
@@ -10,7 +15,38 @@ class ItemBulkView(BulkAPIView):
 	
 	queryset = Item.objects.all()
 	serializer_class = ItemSerializer
+	bulk_create = True
+	bulk_update = True
+	values_read = True
+	query_budget = {'GET': 4}
+	cache_version = catalog_version
 
 	def get_queryset(self):
 		qs = super().get_queryset()
-		return filter_items(qs, self.request.GET)
\ No newline at end of file
+		return filter_items(qs, self.request.GET)
+
+	# Search runs its token expansion queries before the list query
+	@classmethod
+	def get_query_budget(cls, request):
+		budget = cls.query_budget.get(request.method)
+		if budget is not None and request.GET.get('q'):
+			budget += search_query_count(request.GET['q'])
+		return budget
+
+	def get_facets(self, queryset):
+		facets = {
+			'item_type': ('item_type_id', 'item_type__name'),
+			'item_category': ('item_category_id', 'item_category__name'),
+		}
+		if not apps.is_installed('store'):
+			return count_facets(queryset, facets)
+
+		StoreItem = apps.get_model('store', 'StoreItem')
+		in_stock = StoreItem.objects.filter(item=OuterRef('pk'), quantity__gt=F('reserved'))
+		result = count_facets(queryset.annotate(in_stock=Exists(in_stock)), dict(facets, in_stock=('in_stock', None)))
+
+		store_items = StoreItem.objects.filter(item__in=queryset.order_by().values('pk'))
+		result.update(count_facets(
+			store_items, {'location': ('location_id', 'location__name')}, count=Count('item', distinct=True)
+		))
+		return result
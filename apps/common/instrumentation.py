@@ -0,0 +1,161 @@
+import sys
+import threading
+import time
+import weakref
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+from django.db.models import signals as model_signals
+from rest_framework.serializers import Serializer
+
+from . import signals as common_signals
+
+
+N_PLUS_ONE_THRESHOLD = 5
+SERIALIZER_CODE = Serializer.to_representation.__code__
+
+current = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+	pass
+
+
+# Signals whose receivers get their own line in the breakdown. Apps add theirs
+# with register_signals().
+instrumented_signals = [
+	model_signals.pre_save, model_signals.post_save,
+	model_signals.pre_delete, model_signals.post_delete,
+	model_signals.m2m_changed,
+	common_signals.post_bulk_create, common_signals.post_bulk_update,
+	common_signals.pre_batch_delete, common_signals.post_batch_delete,
+]
+
+
+def register_signals(*signals):
+	instrumented_signals.extend(s for s in signals if s not in instrumented_signals)
+
+
+def get_receiver_names():
+	names = {}
+	for signal in instrumented_signals:
+		for key, receiver in signal.receivers:
+			func = receiver() if isinstance(receiver, weakref.ReferenceType) else receiver
+			code = getattr(func, '__code__', None)
+			if code is not None:
+				names[code] = f'{func.__module__}.{func.__qualname__}'
+	return names
+
+
+# Counts the queries run while active, with their time. With origins, it also
+# walks the stack of each query for the signal receiver it ran under and the
+# serializer field that issued it.
+class QueryStats:
+	def __init__(self, origins=True):
+		self.count = 0
+		self.time = 0.0
+		self.paused = 0
+		self.receivers = Counter()
+		self.statements = Counter()
+		self.origins = {}
+		self.receiver_names = get_receiver_names() if origins else None
+
+	def find_origin(self, frame):
+		receiver = field = None
+		while frame is not None and (receiver is None or field is None):
+			code = frame.f_code
+			if receiver is None and code in self.receiver_names:
+				receiver = self.receiver_names[code]
+			if field is None and code is SERIALIZER_CODE:
+				current = frame.f_locals.get('field')
+				if current is not None:
+					field = f'{current.parent.__class__.__name__}.{current.field_name}'
+			frame = frame.f_back
+		return receiver, field
+
+	def __call__(self, execute, sql, params, many, context):
+		if self.paused:
+			return execute(sql, params, many, context)
+
+		start = time.perf_counter()
+		try:
+			return execute(sql, params, many, context)
+		finally:
+			self.time += time.perf_counter() - start
+			self.count += 1
+			self.statements[sql] += 1
+
+			if self.receiver_names is not None:
+				receiver, field = self.find_origin(sys._getframe(1))
+				if receiver:
+					self.receivers[receiver] += 1
+				if field and sql not in self.origins:
+					self.origins[sql] = field
+
+	def duplicates(self, threshold=N_PLUS_ONE_THRESHOLD):
+		return [
+			{'sql': sql, 'count': count, 'origin': self.origins.get(sql)}
+			for sql, count in self.statements.most_common() if count >= threshold
+		]
+
+
+@contextmanager
+def instrument(origins=True):
+	stats = QueryStats(origins)
+	outer = getattr(current, 'stats', None)
+	current.stats = stats
+	try:
+		with ExitStack() as stack:
+			for alias in connections:
+				stack.enter_context(connections[alias].execute_wrapper(stats))
+			yield stats
+	finally:
+		current.stats = outer
+
+
+# Leaves the queries run inside out of the current instrument() block
+@contextmanager
+def uncounted():
+	stats = getattr(current, 'stats', None)
+	if stats is None:
+		yield
+		return
+
+	stats.paused += 1
+	try:
+		yield
+	finally:
+		stats.paused -= 1
+
+
+# Process-wide totals per view, served by QueryMetricsView
+class QueryMetrics:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		self.views = defaultdict(lambda: {
+			'requests': 0, 'queries': 0, 'db_time': 0.0, 'max_queries': 0, 'over_budget': 0, 'receivers': Counter()
+		})
+
+	def record(self, view_name, stats, over_budget=False):
+		with self.lock:
+			view = self.views[view_name]
+			view['requests'] += 1
+			view['queries'] += stats.count
+			view['db_time'] += stats.time
+			view['max_queries'] = max(view['max_queries'], stats.count)
+			view['over_budget'] += over_budget
+			view['receivers'].update(stats.receivers)
+
+	def snapshot(self):
+		with self.lock:
+			return {
+				name: dict(view, db_time=round(view['db_time'], 6), receivers=dict(view['receivers']))
+				for name, view in self.views.items()
+			}
+
+
+query_metrics = QueryMetrics()
@@ -0,0 +1,61 @@
+import logging
+
+from django.conf import settings
+
+from .instrumentation import QueryBudgetExceeded, instrument, query_metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+# Counts the queries and DB time of each request and reports them in the
+# X-Query-Count/X-Query-Time headers and in query_metrics. Authentication and
+# session lookups aren't counted. Views can set query_budget, either a number
+# or a {method: number} dict, or a get_query_budget(request) classmethod.
+# Going over it logs a warning, or raises when settings.QUERY_BUDGET_RAISE is
+# set, which tests opt into. Receiver and serializer field origins are only
+# traced with settings.QUERY_TRACE_ORIGINS.
+class QueryCountMiddleware:
+	def __init__(self, get_response):
+		self.get_response = get_response
+
+	def get_budget(self, request):
+		match = request.resolver_match
+		view_class = getattr(match.func, 'view_class', None) if match else None
+		if hasattr(view_class, 'get_query_budget'):
+			return view_class.get_query_budget(request)
+		budget = getattr(view_class, 'query_budget', None)
+		if isinstance(budget, dict):
+			return budget.get(request.method)
+		return budget
+
+	def get_view_name(self, request):
+		match = request.resolver_match
+		if match is None:
+			return 'unresolved'
+		return match.view_name or match._func_path
+
+	def __call__(self, request):
+		with instrument(origins=getattr(settings, 'QUERY_TRACE_ORIGINS', False)) as stats:
+			response = self.get_response(request)
+
+		response['X-Query-Count'] = str(stats.count)
+		response['X-Query-Time'] = f'{stats.time * 1000:.2f}ms'
+
+		view_name = self.get_view_name(request)
+		budget = self.get_budget(request)
+		over_budget = budget is not None and stats.count > budget
+		query_metrics.record(view_name, stats, over_budget)
+
+		for duplicate in stats.duplicates():
+			logger.warning(
+				"%s %s repeated a query %s times (from %s): %s",
+				request.method, request.path, duplicate['count'], duplicate['origin'] or 'unknown', duplicate['sql']
+			)
+
+		if over_budget:
+			message = f"{request.method} {view_name} ran {stats.count} queries, over its budget of {budget}."
+			if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+				raise QueryBudgetExceeded(message)
+			logger.warning(message)
+		return response
@@ -1,8 +1,103 @@
-from django.db import models
+import threading
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
 
 
 class AbstractUniqueName(models.Model):
 	name = models.CharField(max_length=60, unique=True)
 
 	def __str__(self):
-		return self.name
\ No newline at end of file
+		return self.name
+
+
+# Records the loaded values of `tracked_fields` from the raw row data. Foreign
+# keys are tracked by attname, so nothing is fetched. Unsaved instances start
+# from the field defaults, and tracking resets after each save, once the
+# post_save receivers have seen the old values.
+class TrackedFieldsMixin:
+	tracked_fields = ()
+
+	@classmethod
+	def from_db(cls, db, field_names, values):
+		instance = super().from_db(db, field_names, values)
+		instance.reset_tracking()
+		return instance
+
+	def reset_tracking(self, fields=None):
+		if not hasattr(self, '_tracked_values'):
+			self._tracked_values = {}
+		for name in fields or self.tracked_fields:
+			if name in self.tracked_fields:
+				attname = self._meta.get_field(name).attname
+				if attname in self.__dict__:
+					self._tracked_values[attname] = self.__dict__[attname]
+
+	def get_initial(self, name):
+		field = self._meta.get_field(name)
+		if not hasattr(self, '_tracked_values'):
+			return field.get_default()
+		# Deferred fields count as unchanged
+		return self._tracked_values.get(field.attname, getattr(self, field.attname))
+
+	def has_changed(self, name):
+		return getattr(self, self._meta.get_field(name).attname) != self.get_initial(name)
+
+	def save(self, *args, **kwargs):
+		super().save(*args, **kwargs)
+		self.reset_tracking(kwargs.get('update_fields'))
+
+
+class SequenceManager(models.Manager):
+	def allocate(self, name, count=1, initial=None):
+		with transaction.atomic():
+			if not self.filter(name=name).update(value=F('value') + count):
+				start = initial() if callable(initial) else (initial or 0)
+				try:
+					with transaction.atomic():
+						self.create(name=name, value=start + count)
+				except IntegrityError:
+					self.filter(name=name).update(value=F('value') + count)
+
+			value = self.filter(name=name).values_list('value', flat=True).get()
+		return range(value - count + 1, value + 1)
+
+
+class Sequence(models.Model):
+	name = models.CharField(max_length=100, unique=True)
+	value = models.PositiveBigIntegerField(default=0)
+
+	objects = SequenceManager()
+
+	def __str__(self):
+		return f"{self.name}: {self.value}"
+
+
+# Hands out numbers from a Sequence, reserving `block_size` numbers per database
+# round trip. Leftover numbers are only kept once the allocating transaction commits.
+class SequenceAllocator:
+	def __init__(self, name, block_size=1, initial=None):
+		self.name = name
+		self.block_size = block_size
+		self.initial = initial
+		self.lock = threading.Lock()
+		self.numbers = []
+
+	def keep(self, numbers):
+		with self.lock:
+			self.numbers.extend(numbers)
+
+	def take(self, count=1):
+		with self.lock:
+			numbers, self.numbers = self.numbers[:count], self.numbers[count:]
+
+		missing = count - len(numbers)
+		if missing:
+			block = list(Sequence.objects.allocate(self.name, max(missing, self.block_size), self.initial))
+			numbers += block[:missing]
+			if block[missing:]:
+				transaction.on_commit(lambda: self.keep(block[missing:]))
+		return numbers
+
+	def next(self):
+		return self.take(1)[0]
@@ -0,0 +1,109 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+# Cursor pagination over the queryset's own ordering, with the primary key as a
+# tie-breaker. The cursor holds the last row's ordering values, so every page is
+# a range query on the ordering columns rather than an OFFSET.
+class KeysetPagination(BasePagination):
+	cursor_query_param = 'cursor'
+	page_size_query_param = 'page_size'
+	page_size = api_settings.PAGE_SIZE or 100
+	max_page_size = 1000
+	invalid_cursor_message = 'Invalid cursor.'
+
+	def get_page_size(self, request):
+		try:
+			page_size = int(request.query_params[self.page_size_query_param])
+		except (KeyError, ValueError):
+			return self.page_size
+		return min(max(page_size, 1), self.max_page_size)
+
+	def get_ordering(self, queryset):
+		ordering = [str(field) for field in queryset.query.order_by]
+		if not ordering or ordering[-1].lstrip('-') not in ('pk', 'id'):
+			ordering.append('pk')
+		return ordering
+
+	def encode_cursor(self, values):
+		data = json.dumps(values, cls=DjangoJSONEncoder).encode()
+		return urlsafe_b64encode(data).decode()
+
+	def decode_cursor(self, request):
+		cursor = request.query_params.get(self.cursor_query_param)
+		if not cursor:
+			return None
+		try:
+			values = json.loads(urlsafe_b64decode(cursor.encode()))
+		except (TypeError, ValueError):
+			raise NotFound(self.invalid_cursor_message)
+		if not isinstance(values, list) or len(values) != len(self.ordering):
+			raise NotFound(self.invalid_cursor_message)
+		return values
+
+	# Coerces the decoded values to the ordering fields' types, so a crafted
+	# cursor is a 404 rather than a database error.
+	def get_cursor_values(self, queryset, values):
+		query = queryset.query.chain()
+		try:
+			return [
+				query.resolve_ref(field.lstrip('-')).output_field.to_python(value)
+				for field, value in zip(self.ordering, values)
+			]
+		except (TypeError, ValueError, ValidationError):
+			raise NotFound(self.invalid_cursor_message)
+
+	# (a > x) | (a == x & b > y) | (a == x & b == y & pk > z), flipped for
+	# descending fields.
+	def get_keyset_filter(self, values):
+		conditions = []
+		for i, field in enumerate(self.ordering):
+			name = field.lstrip('-')
+			lookup = 'lt' if field.startswith('-') else 'gt'
+			equal = {f.lstrip('-'): value for f, value in zip(self.ordering[:i], values)}
+			conditions.append(Q(**equal, **{f'{name}__{lookup}': values[i]}))
+		return reduce(or_, conditions)
+
+	def paginate_queryset(self, queryset, request, view=None):
+		self.request = request
+		self.ordering = self.get_ordering(queryset)
+		page_size = self.get_page_size(request)
+
+		keys = {f'keyset_{i}': F(field.lstrip('-')) for i, field in enumerate(self.ordering)}
+		queryset = queryset.annotate(**keys).order_by(*self.ordering)
+
+		values = self.decode_cursor(request)
+		if values is not None:
+			values = self.get_cursor_values(queryset, values)
+			try:
+				queryset = queryset.filter(self.get_keyset_filter(values))
+			except (TypeError, ValueError):
+				raise NotFound(self.invalid_cursor_message)
+
+		page = list(queryset[:page_size + 1])
+		self.next_cursor = None
+		if len(page) > page_size:
+			page = page[:page_size]
+			last = page[-1] if isinstance(page[-1], dict) else page[-1].__dict__
+			self.next_cursor = self.encode_cursor([last[key] for key in keys])
+		return page
+
+	def get_next_link(self):
+		if self.next_cursor is None:
+			return None
+		url = self.request.build_absolute_uri()
+		return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+	def get_paginated_response(self, data):
+		return Response({'next': self.get_next_link(), 'results': data})
@@ -1,4 +1,120 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
 from rest_framework import serializers
+from rest_framework.relations import PKOnlyObject, RelatedField
+from rest_framework.validators import UniqueTogetherValidator
+
+from .signals import post_bulk_create
+
+
+# Query planning
+# Serializers list the relations they read themselves in Meta.select_related
+# and Meta.prefetch_related. Nested serializer fields add their own plan under
+# the field's source: single relations are joined, many relations prefetched.
+# A many field whose source Meta already prefetches (e.g. a filtered Prefetch
+# with to_attr) is left to that lookup.
+def prefix_lookup(source, lookup):
+	if isinstance(lookup, Prefetch):
+		return Prefetch(f'{source}__{lookup.prefetch_through}', queryset=lookup.queryset, to_attr=lookup.to_attr)
+	return f'{source}__{lookup}'
+
+
+def get_query_plan(serializer_class):
+	meta = getattr(serializer_class, 'Meta', None)
+	select = list(getattr(meta, 'select_related', ()))
+	prefetch = list(getattr(meta, 'prefetch_related', ()))
+	prefetched = {lookup.prefetch_to if isinstance(lookup, Prefetch) else lookup for lookup in prefetch}
+
+	for name, field in serializer_class._declared_fields.items():
+		many = isinstance(field, serializers.ListSerializer)
+		child = field.child if many else field
+		if not isinstance(child, serializers.BaseSerializer):
+			continue
+
+		source = (field.source or name).replace('.', '__')
+		child_select, child_prefetch = get_query_plan(type(child))
+		if many:
+			if source in prefetched:
+				continue
+			queryset = child.Meta.model.objects.select_related(*child_select).prefetch_related(*child_prefetch)
+			prefetch.append(Prefetch(source, queryset=queryset))
+		else:
+			select += [source] + [prefix_lookup(source, lookup) for lookup in child_select]
+			prefetch += [prefix_lookup(source, lookup) for lookup in child_prefetch]
+
+	return select, prefetch
+
+
+def apply_query_plan(queryset, serializer_class):
+	select, prefetch = get_query_plan(serializer_class)
+	return queryset.select_related(*select).prefetch_related(*prefetch)
+
+
+# Read-only fast path for lists. Compiles a serializer's fields into values()
+# lookups and passes the raw column values through the same fields'
+# to_representation(), so the output matches the serializer without building
+# model instances. Meta.values_lookups overrides the lookup of fields whose
+# source isn't a column, e.g. {'item_type': 'item_type__name'}.
+class ValuesSerializer:
+	compiled = {}
+
+	def __init__(self, serializer_class):
+		self.lookups = []
+		self.spec = self.compile(serializer_class(), '')
+
+	@classmethod
+	def for_serializer(cls, serializer_class):
+		if serializer_class not in cls.compiled:
+			cls.compiled[serializer_class] = cls(serializer_class)
+		return cls.compiled[serializer_class]
+
+	def add_lookup(self, lookup):
+		if lookup not in self.lookups:
+			self.lookups.append(lookup)
+		return lookup
+
+	def get_converter(self, field):
+		if isinstance(field, RelatedField) and field.use_pk_only_optimization():
+			return lambda value: field.to_representation(PKOnlyObject(pk=value))
+		# Other related fields render the related object, which values() doesn't load
+		if isinstance(field, (
+			RelatedField, serializers.ListSerializer, serializers.ManyRelatedField, serializers.SerializerMethodField
+		)):
+			raise ImproperlyConfigured(f"{field.__class__.__name__} '{field.field_name}' can't be read from values().")
+		return field.to_representation
+
+	def compile(self, serializer, prefix):
+		overrides = getattr(getattr(serializer, 'Meta', None), 'values_lookups', {})
+		spec = []
+		for name, field in serializer.fields.items():
+			if field.write_only:
+				continue
+
+			lookup = self.add_lookup(overrides.get(name) or prefix + field.source.replace('.', '__'))
+			if isinstance(field, serializers.Serializer):
+				spec.append((name, lookup, self.compile(field, lookup + '__')))
+			else:
+				spec.append((name, lookup, self.get_converter(field)))
+		return spec
+
+	def values(self, queryset):
+		return queryset.values(*self.lookups)
+
+	def build(self, spec, row):
+		ret = {}
+		for name, lookup, convert in spec:
+			value = row[lookup]
+			if value is None:
+				ret[name] = None
+			elif isinstance(convert, list):
+				ret[name] = self.build(convert, row)
+			else:
+				ret[name] = convert(value)
+		return ret
+
+	def to_representation(self, row):
+		return self.build(self.spec, row)
 
 
 class BulkSerializer(serializers.Serializer):
@@ -16,4 +132,106 @@ class BulkSerializer(serializers.Serializer):
 		return {d['id']: d for d in self.validated_data['data']}
 
 	def get_delete_ids(self):
-		return [d['id'] for d in self.validated_data['data']]
\ No newline at end of file
+		return [d['id'] for d in self.validated_data['data']]
+
+
+# Checks unique together constraints for a batch with one query per validator.
+# rows is a list of (position, pk, attrs) where pk is None for new rows.
+def validate_unique_together(model, validators, rows):
+	errors = {}
+	updating = {pk for position, pk, attrs in rows if pk is not None}
+
+	for validator in validators:
+		fields = validator.fields
+		keys = [
+			(position, pk, tuple(getattr(attrs[f], 'pk', attrs[f]) for f in fields))
+			for position, pk, attrs in rows if all(f in attrs for f in fields)
+		]
+
+		lookup = {f'{f}__in': {key[i] for p, pk, key in keys} for i, f in enumerate(fields)}
+		existing = {
+			tuple(values): pk for pk, *values in model.objects.filter(**lookup).values_list('pk', *fields)
+			if pk not in updating
+		}
+
+		seen = set()
+		for position, pk, key in keys:
+			if key in existing or key in seen:
+				errors[position] = f"Dictionary instance at position '{position}' must make a unique set of {', '.join(fields)}"
+			seen.add(key)
+	return errors
+
+
+def split_unique_together(serializer):
+	unique_together = [v for v in serializer.validators if isinstance(v, UniqueTogetherValidator)]
+	serializer.validators = [v for v in serializer.validators if v not in unique_together]
+	return unique_together
+
+
+class BulkMixin:
+	def get_or_create_cached(self, model, **kwargs):
+		resolved = self.context.setdefault('resolved', {})
+
+		key = (model, tuple(sorted(kwargs.items())))
+		if key not in resolved:
+			resolved[key] = model.objects.get_or_create(**kwargs)[0]
+		return resolved[key]
+
+	def before_bulk_create(self, instances):
+		pass
+
+	def after_bulk_create(self, instances):
+		pass
+
+	def before_bulk_update(self, instance, fields):
+		return fields
+
+
+class BulkListSerializer(serializers.ListSerializer):
+	batch_size = 500
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		# Unique together checks run once for the whole batch in validate()
+		self.unique_together = split_unique_together(self.child)
+
+	def validate(self, attrs):
+		errors = validate_unique_together(
+			self.child.Meta.model, self.unique_together, [(i, None, d) for i, d in enumerate(attrs)]
+		)
+		if errors:
+			raise serializers.ValidationError([errors[i] for i in sorted(errors)])
+		return attrs
+
+	# Only reached when a conflicting row appeared after validate(). Inserts the
+	# rows one at a time in a savepoint that is always rolled back, to report
+	# which ones the database refuses without echoing its error text.
+	def find_integrity_errors(self, model, instances):
+		errors = {}
+		with transaction.atomic():
+			for position, instance in enumerate(instances):
+				try:
+					with transaction.atomic():
+						model.objects.bulk_create([instance])
+				except IntegrityError:
+					errors[position] = f"Dictionary instance at position '{position}' conflicts with an existing row"
+			transaction.set_rollback(True)
+		return errors or {0: "The data conflicts with existing rows"}
+
+	def create(self, validated_data):
+		model = self.child.Meta.model
+		instances = [model(**attrs) for attrs in validated_data]
+
+		with transaction.atomic():
+			self.child.before_bulk_create(instances)
+			try:
+				with transaction.atomic():
+					model.objects.bulk_create(instances, batch_size=self.batch_size)
+			except IntegrityError:
+				errors = self.find_integrity_errors(model, instances)
+				raise serializers.ValidationError([errors[i] for i in sorted(errors)])
+
+			self.child.after_bulk_create(instances)
+			post_bulk_create.send(sender=model, instances=instances)
+
+		return instances
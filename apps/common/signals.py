@@ -0,0 +1,16 @@
+from django.db.models.signals import ModelSignal
+
+
+# Sent by BulkListSerializer after a batch of instances is inserted with
+# bulk_create, which doesn't send post_save. Arguments: instances
+post_bulk_create = ModelSignal(use_caching=True)
+
+# Sent by BulkAPIView after instances are written with bulk_update, once per
+# group of changed fields. Arguments: instances, fields
+post_bulk_update = ModelSignal(use_caching=True)
+
+# Sent by delete_in_batches around each batch's collector.delete(). Per-row
+# delete receivers can check in_batch_delete() and leave their work to these.
+# Arguments: collector
+pre_batch_delete = ModelSignal(use_caching=True)
+post_batch_delete = ModelSignal(use_caching=True)
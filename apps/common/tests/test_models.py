@@ -0,0 +1,35 @@
+from django.db import transaction
+from django.test import TestCase
+
+from common.models import Sequence, SequenceAllocator
+
+
+class SequenceTests(TestCase):
+	def test_allocate_starts_after_initial(self):
+		self.assertEqual(Sequence.objects.allocate('test', initial=lambda: 41), range(42, 43))
+		self.assertEqual(Sequence.objects.allocate('test', 3), range(43, 46))
+
+	def test_allocation_rolls_back_with_transaction(self):
+		Sequence.objects.allocate('test')
+		try:
+			with transaction.atomic():
+				Sequence.objects.allocate('test')
+				raise ValueError
+		except ValueError:
+			pass
+		self.assertEqual(Sequence.objects.allocate('test'), range(2, 3))
+
+
+class SequenceAllocatorTests(TestCase):
+	def test_block_allocation(self):
+		allocator = SequenceAllocator('test', block_size=10)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.assertEqual(allocator.next(), 1)
+
+		with self.assertNumQueries(0):
+			self.assertEqual(allocator.take(3), [2, 3, 4])
+		self.assertEqual(Sequence.objects.get(name='test').value, 10)
+
+	def test_take_more_than_block(self):
+		allocator = SequenceAllocator('test', block_size=2)
+		self.assertEqual(allocator.take(5), [1, 2, 3, 4, 5])
@@ -0,0 +1,30 @@
+from unittest import mock
+
+from django.db import OperationalError, transaction
+from django.test import TransactionTestCase
+
+from common.utils import retry_on
+
+
+class RetryOnTests(TransactionTestCase):
+	def setUp(self):
+		self.calls = 0
+
+	@retry_on(OperationalError, attempts=3)
+	def fail(self):
+		self.calls += 1
+		raise OperationalError('database is locked')
+
+	@mock.patch('common.utils.time.sleep')
+	def test_retries_outside_a_transaction(self, sleep):
+		with self.assertRaises(OperationalError):
+			self.fail()
+		self.assertEqual(self.calls, 3)
+		self.assertEqual(sleep.call_count, 2)
+
+	@mock.patch('common.utils.time.sleep')
+	def test_raises_at_once_inside_a_transaction(self, sleep):
+		with self.assertRaises(OperationalError), transaction.atomic():
+			self.fail()
+		self.assertEqual(self.calls, 1)
+		sleep.assert_not_called()
@@ -1,5 +1,20 @@
+import functools
+import random
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import router, transaction
+from django.db.models import Count
+from django.db.models.deletion import Collector
 from rest_framework.renderers import JSONRenderer
 
+from .signals import post_batch_delete, pre_batch_delete
+
 
 # Admin
 def hide_admin_btns(extra_context, show_save=False, show_save_add=False, close=False):
@@ -13,7 +28,147 @@ def remove_field(field_list, field):
 		field_list.remove(field)
 
 
-# Misc.
-class PrettyJsonRenderer(JSONRenderer):    
+# Database
+# Retries only at the outermost transaction. Inside an atomic block the locks
+# belong to the enclosing transaction and an error has already broken it, so
+# the error goes straight up to whoever owns that transaction.
+def retry_on(exceptions, attempts=5, backoff=0.05, max_backoff=1):
+	def decorator(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			if transaction.get_connection().in_atomic_block:
+				return func(*args, **kwargs)
+			for attempt in range(attempts):
+				try:
+					return func(*args, **kwargs)
+				except exceptions:
+					if attempt == attempts - 1:
+						raise
+					delay = min(backoff * 2 ** attempt, max_backoff)
+					time.sleep(delay + random.uniform(0, delay))
+		return wrapper
+	return decorator
+
+
+batch_delete_state = threading.local()
+
+
+def in_batch_delete():
+	return getattr(batch_delete_state, 'active', False)
+
+
+# Deletes qs in batches of primary keys, each in its own transaction.
+# Returns a Counter of deleted rows per model label, cascades included.
+def delete_in_batches(qs, batch_size=500, progress=None):
+	model = qs.model
+	using = router.db_for_write(model)
+	pks = list(qs.values_list('pk', flat=True))
+	counts = Counter()
+
+	for i in range(0, len(pks), batch_size):
+		with transaction.atomic(using=using):
+			collector = Collector(using=using)
+			collector.collect(model.objects.filter(pk__in=pks[i:i+batch_size]))
+			pre_batch_delete.send(sender=model, collector=collector)
+
+			batch_delete_state.active = True
+			try:
+				deleted = collector.delete()[1]
+			finally:
+				batch_delete_state.active = False
+
+			post_batch_delete.send(sender=model, collector=collector)
+
+		counts.update(deleted)
+		if progress:
+			progress(min(i + batch_size, len(pks)), len(pks), deleted)
+
+	return counts
+
+
+# Counts rows per value of each facet with one grouped query. facets maps a
+# facet name to (value lookup, label lookup or None).
+def count_facets(queryset, facets, count=None):
+	lookups = list(dict.fromkeys(lookup for pair in facets.values() for lookup in pair if lookup))
+	rows = queryset.order_by().values(*lookups).annotate(facet_count=count or Count('pk'))
+
+	counts = {name: {} for name in facets}
+	for row in rows:
+		for name, (value_lookup, label_lookup) in facets.items():
+			value = row[value_lookup]
+			entry = counts[name].get(value)
+			if entry is None:
+				entry = counts[name][value] = {'id': value, 'count': 0}
+				if label_lookup:
+					entry['name'] = row[label_lookup]
+			entry['count'] += row['facet_count']
+
+	return {
+		name: sorted(entries.values(), key=lambda entry: (-entry['count'], str(entry.get('name', entry['id']))))
+		for name, entries in counts.items()
+	}
+
+
+# Cache
+# Whether every worker reads and writes the same cache. With a per-process
+# backend a bump only reaches the process that made it, so versioned keys and
+# ETags would go stale elsewhere. settings.CACHE_IS_SHARED overrides the guess,
+# e.g. for a single process deployment.
+def cache_is_shared():
+	shared = getattr(settings, 'CACHE_IS_SHARED', None)
+	if shared is not None:
+		return shared
+	return not isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+
+
+# A counter in the cache that names the current state of some data. Cached
+# values keyed on it go stale together when it's bumped. A missing counter
+# restarts from the clock so old keys are never reused.
+class CacheVersion:
+	def __init__(self, name):
+		self.key = f'{name}:version'
+
+	def get(self):
+		version = cache.get(self.key)
+		if version is None:
+			cache.add(self.key, time.time_ns(), None)
+			version = cache.get(self.key)
+		return version
+
+	def incr(self):
+		try:
+			cache.incr(self.key)
+		except ValueError:
+			cache.set(self.key, time.time_ns(), None)
+
+	# Bumps now and again on commit, so a reader that saw the old data during
+	# the transaction can't keep it cached under the new version.
+	def bump(self):
+		self.incr()
+		transaction.on_commit(self.incr)
+
+
+# Renderers
+class CompactJsonRenderer(JSONRenderer):
+	compact = True
+	ensure_ascii = False
+
+
+# Only chosen with ?format=pretty
+class PrettyJsonRenderer(CompactJsonRenderer):
+	format = 'pretty'
+
 	def get_indent(self, accepted_media_type, renderer_context):
-		return 2
\ No newline at end of file
+		return 2
+
+
+# Chosen with ?format=stream. List views hand it an iterable of rows through
+# render_stream() and it yields the JSON array piece by piece.
+class StreamingJsonRenderer(CompactJsonRenderer):
+	format = 'stream'
+
+	def render_stream(self, rows):
+		yield b'['
+		for i, row in enumerate(rows):
+			yield (b',' if i else b'') + self.render(row)
+		yield b']'
@@ -1,12 +1,36 @@
+import hashlib
+import logging
+
 from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags
 
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import GenericAPIView, ListCreateAPIView
 from rest_framework.mixins import ListModelMixin
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+
+from .instrumentation import query_metrics
+from .pagination import KeysetPagination
+from .serializers import (
+	BulkListSerializer,
+	BulkSerializer,
+	ValuesSerializer,
+	apply_query_plan,
+	split_unique_together,
+	validate_unique_together
+)
+from .signals import post_bulk_update
+from .utils import StreamingJsonRenderer, cache_is_shared, delete_in_batches
+
 
-from .serializers import BulkSerializer
+logger = logging.getLogger(__name__)
 
 
 class GenericAPISerializerView(GenericAPIView):
@@ -30,12 +54,114 @@ class BulkAPIView(ListCreateAPIView):
 	app_label = None
 	model_name = None
 	queryset = None
+	pagination_class = KeysetPagination
 	serializer_class = None
+	read_serializer_class = None
+	values_read = False
+	cache_version = None
+	cache_timeout = 60 * 60
+	bulk_create = False
+	bulk_update = False
+	bulk_batch_size = 500
 
 	def setup(self, request, *args, **kwargs):
 		super().setup(request, *args, **kwargs)
 		self.model = apps.get_model(app_label=self.app_label, model_name=self.model_name)
 
+	def get_serializer_class(self):
+		if self.request.method == 'GET' and self.read_serializer_class is not None:
+			return self.read_serializer_class
+		return super().get_serializer_class()
+
+	def filter_queryset(self, queryset):
+		queryset = super().filter_queryset(queryset)
+		if self.request.method == 'GET':
+			if self.values_read:
+				queryset = self.get_values_serializer().values(queryset)
+			else:
+				queryset = apply_query_plan(queryset, self.get_serializer_class())
+		return queryset
+
+	def get_values_serializer(self):
+		return ValuesSerializer.for_serializer(self.get_serializer_class())
+
+	def get_bulk_serializer(self, *args, **kwargs):
+		kwargs['child'] = self.get_serializer()
+		kwargs.setdefault('context', self.get_serializer_context())
+		return BulkListSerializer(*args, **kwargs)
+
+	# Streams every matching row from a server-side cursor, unpaginated
+	def stream_list(self, request):
+		queryset = self.filter_queryset(self.get_queryset())
+		serializer = self.get_values_serializer() if self.values_read else self.get_serializer()
+		rows = (serializer.to_representation(obj) for obj in queryset.iterator(chunk_size=self.bulk_batch_size))
+		stream = request.accepted_renderer.render_stream(rows)
+		return StreamingHttpResponse(stream, content_type=request.accepted_renderer.media_type)
+
+	# Rendered GET lists are cached under cache_version (a CacheVersion), the
+	# host, the full path and the renderer, and the same key is the ETag. Only
+	# with a shared cache, as other workers wouldn't see the version bumps.
+	def get_cache_key(self, request):
+		key = f'{self.cache_version.get()}:{request.get_host()}:{request.get_full_path()}:{request.accepted_renderer.format}'
+		return hashlib.md5(key.encode()).hexdigest()
+
+	def is_cacheable(self, request):
+		return (
+			self.cache_version is not None and
+			cache_is_shared() and
+			not request.query_params.get('facets') and
+			not isinstance(request.accepted_renderer, StreamingJsonRenderer)
+		)
+
+	def get(self, request, *args, **kwargs):
+		self.cache_key = None
+		if not self.is_cacheable(request):
+			return super().get(request, *args, **kwargs)
+
+		self.cache_key = self.get_cache_key(request)
+		etag = f'"{self.cache_key}"'
+		if etag in parse_etags(request.headers.get('If-None-Match', '')):
+			response = HttpResponseNotModified()
+			response['ETag'] = etag
+			return response
+
+		cached = cache.get(f'response:{self.cache_key}')
+		if cached is not None:
+			content, content_type = cached
+			response = HttpResponse(content, content_type=content_type)
+			response['ETag'] = etag
+			return response
+		return super().get(request, *args, **kwargs)
+
+	def finalize_response(self, request, response, *args, **kwargs):
+		response = super().finalize_response(request, response, *args, **kwargs)
+		if getattr(self, 'cache_key', None) and isinstance(response, Response) and response.status_code == 200:
+			response.render()
+			cache.set(f'response:{self.cache_key}', (response.content, response['Content-Type']), self.cache_timeout)
+			response['ETag'] = f'"{self.cache_key}"'
+		return response
+
+	# Counts for the ?facets=1 mode, over the filtered but unpaginated queryset
+	def get_facets(self, queryset):
+		return None
+
+	def list(self, request, *args, **kwargs):
+		if request.query_params.get('facets'):
+			facets = self.get_facets(self.get_queryset())
+			if facets is not None:
+				return Response(facets)
+		if isinstance(request.accepted_renderer, StreamingJsonRenderer):
+			return self.stream_list(request)
+		if not self.values_read:
+			return super().list(request, *args, **kwargs)
+
+		queryset = self.filter_queryset(self.get_queryset())
+		serializer = self.get_values_serializer()
+		page = self.paginate_queryset(queryset)
+		if page is None:
+			return Response([serializer.to_representation(row) for row in queryset])
+		return self.get_paginated_response([serializer.to_representation(row) for row in page])
+
 	def get_delete_ids(self):
 		serializer = BulkSerializer(data={'data': self.request.data})
 		serializer.is_valid(raise_exception=True)
@@ -46,7 +172,66 @@ class BulkAPIView(ListCreateAPIView):
 		serializer.is_valid(raise_exception=True)
 		return serializer.get_update_ids()
 
+	def get_changed_fields(self, instance, validated_data):
+		fields = set()
+		for name, value in validated_data.items():
+			field = self.model._meta.get_field(name)
+			if field.many_to_one or field.one_to_one:
+				changed = getattr(instance, field.attname) != getattr(value, 'pk', value)
+			else:
+				changed = getattr(instance, name) != value
+
+			# Also caches related objects for the response
+			setattr(instance, name, value)
+			if changed:
+				fields.add(name)
+		return fields
+
+	def handle_bulk_update(self, request, *args, **kwargs):
+		id_list = self.get_update_ids()
+		objs = self.model.objects.in_bulk([int(pk) for pk in id_list])
+		context = self.get_serializer_context()
+
+		errors, rows, unique_together = {}, [], []
+		for position, data in enumerate(request.data):
+			obj = objs.get(int(data['id']))
+			if obj is None:
+				errors[position] = [f"Dictionary instance at position '{position}' doesn't match an existing {self.model_name}"]
+				continue
+
+			serializer = self.get_serializer(instance=obj, data=data, context=context)
+			unique_together = split_unique_together(serializer)
+			if serializer.is_valid():
+				rows.append((position, obj, serializer))
+			else:
+				errors[position] = serializer.errors
+
+		unique_errors = validate_unique_together(
+			self.model, unique_together, [(p, obj.pk, s.validated_data) for p, obj, s in rows]
+		)
+		errors.update({position: [message] for position, message in unique_errors.items()})
+		if errors:
+			raise ValidationError({'data': {position: errors[position] for position in sorted(errors)}})
+
+		groups = {}
+		for position, obj, serializer in rows:
+			fields = self.get_changed_fields(obj, serializer.validated_data)
+			fields = serializer.before_bulk_update(obj, fields) if hasattr(serializer, 'before_bulk_update') else fields
+			if fields:
+				groups.setdefault(frozenset(fields), []).append(obj)
+
+		with transaction.atomic():
+			for fields, group in groups.items():
+				self.model.objects.bulk_update(group, fields, batch_size=self.bulk_batch_size)
+				post_bulk_update.send(sender=self.model, instances=group, fields=fields)
+
+		updated = [obj for position, obj, serializer in rows]
+		return Response(self.get_serializer(updated, many=True).data)
+
 	def handle_update(self, request, *args, **kwargs):
+		if self.bulk_update:
+			return self.handle_bulk_update(request, *args, **kwargs)
+
 		id_list = self.get_update_ids()
 		qs = self.model.objects.filter(pk__in=id_list)
 		for obj in qs:
@@ -57,7 +242,10 @@ class BulkAPIView(ListCreateAPIView):
 		return Response(self.get_serializer(qs, many=True).data)
 
 	def post(self, request, *args, **kwargs):
-		serializer = self.get_serializer(data=request.data, many=True)
+		if self.bulk_create:
+			serializer = self.get_bulk_serializer(data=request.data)
+		else:
+			serializer = self.get_serializer(data=request.data, many=True)
 		serializer.is_valid(raise_exception=True)
 		serializer.save()
 		headers = self.get_success_headers(serializer.data)
@@ -69,10 +257,28 @@ class BulkAPIView(ListCreateAPIView):
 	def put(self, request, *args, **kwargs):
 		return self.handle_update(request, *args, **kwargs)
 
+	def log_delete_progress(self, done, total, deleted):
+		logger.info("Deleted %s/%s %s instance(s): %s", done, total, self.model_name, deleted)
+
 	def delete(self, request, *args, **kwargs):
 		id_list = self.get_delete_ids()
 		qs = self.model.objects.filter(id__in=id_list)
-		count = qs.count()
-		qs.delete()
-		result = {'count': f'{count} {self.model_name} instance(s) have been deleted.'}
-		return Response(result)
\ No newline at end of file
+		deleted = delete_in_batches(qs, self.bulk_batch_size, progress=self.log_delete_progress)
+		count = deleted.get(self.model._meta.label, 0)
+		result = {
+			'count': f'{count} {self.model_name} instance(s) have been deleted.',
+			'deleted': dict(deleted)
+		}
+		return Response(result)
+
+
+class QueryMetricsView(APIView):
+	permission_classes = (IsAdminUser,)
+	http_method_names = ['get', 'delete']
+
+	def get(self, request, *args, **kwargs):
+		return Response(query_metrics.snapshot())
+
+	def delete(self, request, *args, **kwargs):
+		query_metrics.reset()
+		return Response(status=status.HTTP_204_NO_CONTENT)
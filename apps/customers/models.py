@@ -5,11 +5,13 @@ from django.dispatch import receiver
 from django.utils import timezone
 
 from address.models import AbstractAddress
+from common.models import TrackedFieldsMixin
 
 
 # Models
-class Customer(models.Model):
+class Customer(TrackedFieldsMixin, models.Model):
 	PURCHASE_WAIT_TIME = 5
+	tracked_fields = ('price_level',) if apps.is_installed('store') else ()
 
 	user = models.OneToOneField('users.User', related_name='customer', on_delete=models.CASCADE)
 	if apps.is_installed('store'):
@@ -23,11 +25,6 @@ class Customer(models.Model):
 	class Meta:
 		verbose_name = 'Customer Info'
 
-	def __init__(self, *args, **kwargs):
-		super().__init__(*args, **kwargs)
-		if apps.is_installed('store'):
-			self.old_price_level = self.price_level
-
 	def __str__(self):
 		return str(self.user)
 		
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from rangefilter.filter import DateRangeFilter
 
+from catalog.models import catalog_version
 from common.mixins import NoAddDeleteMixin, NoChangeDeleteMixin
 from store.models import *
 
@@ -8,11 +9,13 @@ from store.models import *
 # Actions
 def make_active(modeladmin, request, queryset):
 	queryset.update(is_active=True)
+	catalog_version.bump()
 make_active.short_description = "Mark selected items as active"
 
 
 def make_inactive(modeladmin, request, queryset):
 	queryset.update(is_active=False)
+	catalog_version.bump()
 make_inactive.short_description = "Mark selected items as inactive"
 
 
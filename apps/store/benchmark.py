@@ -0,0 +1,191 @@
+import itertools
+import json
+import time
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+
+import stripe
+from django.conf import settings
+from django.test import Client
+
+
+# Fake Stripe
+# Stands in for the Stripe resources the store and customers apps call, so the
+# checkout and card flows can run offline. Each call sleeps for `latency`
+# seconds to stand in for the network round trip.
+class FakeStripe:
+	def __init__(self, latency=0.0):
+		self.latency = latency
+		self.ids = itertools.count(1)
+		self.calls = []
+
+	def call(self, name, prefix, **data):
+		self.calls.append(name)
+		if self.latency:
+			time.sleep(self.latency)
+		return stripe.util.convert_to_stripe_object(dict(data, id=f'{prefix}_fake_{next(self.ids)}', object=prefix))
+
+	def card(self, src_id='src_fake'):
+		card = {'fingerprint': 'fake', 'exp_month': 12, 'exp_year': 2099}
+		return stripe.util.convert_to_stripe_object({'id': src_id, 'object': 'source', 'card': card})
+
+	def patches(self):
+		return [
+			('PaymentIntent', 'create', lambda **kwargs: self.call('PaymentIntent.create', 'pi', **kwargs)),
+			('PaymentIntent', 'confirm', lambda pk, **kwargs: self.call('PaymentIntent.confirm', 'pi', status='succeeded')),
+			('Refund', 'create', lambda **kwargs: self.call('Refund.create', 're', **kwargs)),
+			('Customer', 'create', lambda **kwargs: self.call('Customer.create', 'cus', **kwargs)),
+			('Customer', 'create_source', lambda pk, **kwargs: self.call('Customer.create_source', 'src')),
+			('Customer', 'modify_source', lambda pk, src_id, **kwargs: self.call('Customer.modify_source', 'src')),
+			('Customer', 'delete_source', lambda pk, src_id, **kwargs: self.call('Customer.delete_source', 'src')),
+			('Customer', 'retrieve_source', lambda pk, src_id, **kwargs: self.card(src_id)),
+			('Customer', 'list_sources', lambda pk, **kwargs: {'data': []}),
+			('Source', 'retrieve', lambda pk, **kwargs: self.card(pk)),
+		]
+
+
+@contextmanager
+def fake_stripe(latency=0.0):
+	fake = FakeStripe(latency)
+	with ExitStack() as stack:
+		for resource, method, func in fake.patches():
+			stack.enter_context(mock.patch.object(getattr(stripe, resource), method, func))
+		yield fake
+
+
+# Scenarios
+# One scenario instance per user; request(i) makes the i-th timed request.
+# Setup a request needs (e.g. filling the cart before a checkout) goes in
+# prepare(i), which isn't timed.
+class Scenario:
+	name = None
+
+	def __init__(self, client, user, data):
+		self.client = client
+		self.user = user
+		self.data = data
+
+	def prepare(self, i):
+		pass
+
+	def request(self, i):
+		raise NotImplementedError
+
+
+class BrowseCatalog(Scenario):
+	name = 'browse'
+	next_url = None
+
+	def request(self, i):
+		response = self.client.get(self.next_url or '/catalog/?page_size=50')
+		self.next_url = response.json()['next']
+		return response
+
+
+class FilterStore(Scenario):
+	name = 'filter'
+
+	def request(self, i):
+		item_type, item = self.data['store_filters'][i % len(self.data['store_filters'])]
+		return self.client.get(f'/store/?type={item_type}&item={item}&page_size=50')
+
+
+class AddToCart(Scenario):
+	name = 'cart'
+
+	def request(self, i):
+		store_item = self.data['store_items'][i % len(self.data['store_items'])]
+		return self.client.post(f'/store/cart/{store_item}/', {'quantity': 1}, content_type='application/json')
+
+
+class Checkout(Scenario):
+	name = 'checkout'
+
+	def prepare(self, i):
+		store_item = self.data['store_items'][i % len(self.data['store_items'])]
+		self.client.post(f'/store/cart/{store_item}/', {'quantity': 1}, content_type='application/json')
+
+	def request(self, i):
+		return self.client.post('/store/checkout/', {'card': self.data['cards'][self.user.pk]}, content_type='application/json')
+
+
+SCENARIOS = {scenario.name: scenario for scenario in (BrowseCatalog, FilterStore, AddToCart, Checkout)}
+
+
+# Runner
+def percentile(values, pct):
+	values = sorted(values)
+	if not values:
+		return 0.0
+	index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+	return values[index]
+
+
+def get_host():
+	hosts = [host for host in settings.ALLOWED_HOSTS if host != '*']
+	return hosts[0].lstrip('.') if hosts else 'localhost'
+
+
+def run_scenario(scenario_class, users, data, requests):
+	runs = []
+	for user in users:
+		client = Client(HTTP_HOST=get_host())
+		client.force_login(user)
+		runs.append(scenario_class(client, user, data))
+
+	timings, queries, errors = [], [], 0
+	start = time.perf_counter()
+	for i in range(requests):
+		scenario = runs[i % len(runs)]
+		scenario.prepare(i)
+
+		request_start = time.perf_counter()
+		response = scenario.request(i)
+		timings.append(time.perf_counter() - request_start)
+
+		queries.append(int(response.get('X-Query-Count', 0)))
+		errors += response.status_code >= 400
+	elapsed = time.perf_counter() - start
+
+	return {
+		'requests': requests,
+		'errors': errors,
+		'rps': round(requests / elapsed, 2) if elapsed else 0.0,
+		'p50_ms': round(percentile(timings, 50) * 1000, 2),
+		'p95_ms': round(percentile(timings, 95) * 1000, 2),
+		'p99_ms': round(percentile(timings, 99) * 1000, 2),
+		'queries_per_request': round(sum(queries) / len(queries), 2) if queries else 0.0,
+	}
+
+
+# Baselines
+def load_baseline(path):
+	try:
+		with open(path) as f:
+			return json.load(f)
+	except FileNotFoundError:
+		return {}
+
+
+def save_baseline(path, results):
+	baseline = load_baseline(path)
+	baseline.update(results)
+	with open(path, 'w') as f:
+		json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+# Lists what got worse than the baseline: p95 latency by more than `tolerance`
+# (a fraction) and any increase in queries per request.
+def compare_to_baseline(baseline, results, tolerance=0.2):
+	regressions = []
+	for name, result in results.items():
+		base = baseline.get(name)
+		if not base:
+			continue
+		if result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+			regressions.append(f"{name}: p95 {base['p95_ms']}ms -> {result['p95_ms']}ms")
+		if result['queries_per_request'] > base['queries_per_request']:
+			regressions.append(
+				f"{name}: queries/request {base['queries_per_request']} -> {result['queries_per_request']}"
+			)
+	return regressions
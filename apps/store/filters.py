@@ -1,20 +1,25 @@
+from django.template.defaultfilters import slugify
+
+from catalog.search import search
+
+
 def filter_store_items(qs, data):
 	pk = data.get('pk', '')
-	item_type = data.get('type', '')
-	item_category = data.get('category', '')
-	item = data.get('item', '')
+	item_type = slugify(data.get('type', ''))
+	item_category = slugify(data.get('category', ''))
+	item = slugify(data.get('item', ''))
+	query = data.get('q', '')
 
 	if pk:
-		qs = qs.filter(pk=pk)
-	else:
-		qs = qs.filter(
-			item__item_type__slug__icontains=item_type,
-			item__item_category__slug__icontains=item_category,
-			item__slug__icontains=item
-		).exclude(
-			item__item_type__slug__iexact='',
-			item__item_category__slug__iexact='',
-			item__slug__iexact=''
-		)
+		return qs.filter(pk=pk)
+
+	if item_type:
+		qs = qs.filter(item__item_type__slug=item_type)
+	if item_category:
+		qs = qs.filter(item__item_category__slug=item_category)
+	if item:
+		qs = qs.filter(item__slug=item)
 
-	return qs.order_by('item__item_type__name', 'item__item_category__name', 'item__name')
\ No newline at end of file
+	if query:
+		return search(qs, query, item_field='item')
+	return qs.exclude(item__slug='').order_by('item__item_type__name', 'item__item_category__name', 'item__name')
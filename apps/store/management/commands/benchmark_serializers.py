@@ -0,0 +1,81 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from catalog.models import Item, ItemCategory, ItemType, Parcel
+from catalog.serializers import ItemSerializer
+from common.serializers import ValuesSerializer, apply_query_plan
+from common.utils import CompactJsonRenderer
+from store.models import Location, StoreItem
+from store.serializers import StoreItemReadSerializer
+
+
+class Command(BaseCommand):
+	help = "Compares the ModelSerializer and values() read paths for the catalog and store listings."
+
+	def add_arguments(self, parser):
+		parser.add_argument('--rows', type=int, default=100000)
+		parser.add_argument('--batch-size', type=int, default=5000)
+		parser.add_argument(
+			'--existing', action='store_true',
+			help="Benchmark the rows already in the database instead of seeding (and rolling back) new ones."
+		)
+
+	def seed(self, rows, batch_size):
+		item_type = ItemType.objects.get_or_create(name='Benchmark')[0]
+		item_category = ItemCategory.objects.get_or_create(name='Benchmark')[0]
+		parcel = Parcel.objects.create(length=10, width=5, height=4, weight=1)
+		location = Location.objects.create(
+			name='Benchmark', line1='1 Main St', city='New York', state='NY', zipcode='10001', country='US'
+		)
+
+		Item.objects.bulk_create([
+			Item(
+				item_type=item_type, item_category=item_category, parcel=parcel,
+				name=f'Benchmark {i}', slug=f'benchmark-{i}', number=str(i), description=f'Benchmark {i} description'
+			)
+			for i in range(rows)
+		], batch_size=batch_size)
+
+		item_ids = Item.objects.filter(item_type=item_type).values_list('pk', flat=True)
+		StoreItem.objects.bulk_create(
+			[StoreItem(item_id=pk, location=location, quantity=10) for pk in item_ids], batch_size=batch_size
+		)
+		self.stdout.write(f"Seeded {rows} item(s) and store item(s).")
+
+	def time(self, func):
+		start = time.perf_counter()
+		result = func()
+		return result, time.perf_counter() - start
+
+	def compare(self, label, queryset, serializer_class):
+		renderer = CompactJsonRenderer()
+		values_serializer = ValuesSerializer.for_serializer(serializer_class)
+
+		def serializer_path():
+			qs = apply_query_plan(queryset, serializer_class)
+			return renderer.render(serializer_class(qs, many=True).data)
+
+		def values_path():
+			rows = values_serializer.values(queryset)
+			return renderer.render([values_serializer.to_representation(row) for row in rows])
+
+		slow, slow_time = self.time(serializer_path)
+		fast, fast_time = self.time(values_path)
+		if slow != fast:
+			self.stdout.write(self.style.ERROR(f"{label}: outputs differ."))
+
+		self.stdout.write(
+			f"{label}: serializer {slow_time:.2f}s, values {fast_time:.2f}s "
+			f"({slow_time / max(fast_time, 1e-9):.1f}x), {len(fast)} bytes"
+		)
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			if not options['existing']:
+				self.seed(options['rows'], options['batch_size'])
+
+			self.compare('Items', Item.objects.order_by('pk'), ItemSerializer)
+			self.compare('Store items', StoreItem.objects.order_by('pk'), StoreItemReadSerializer)
+			transaction.set_rollback(True)
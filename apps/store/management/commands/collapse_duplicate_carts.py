@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.models import collapse_duplicate_carts
+
+
+class Command(BaseCommand):
+	help = "Folds duplicate open carts into each user's oldest one. Run before adding the unique_active_order constraint."
+
+	def handle(self, *args, **options):
+		count = collapse_duplicate_carts()
+		self.stdout.write(self.style.SUCCESS(f"Removed {count} duplicate cart(s)."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from common.utils import delete_in_batches
+from store.models import Price, materialize_prices
+
+
+class Command(BaseCommand):
+	help = "Creates missing prices for every item under each price level."
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=1000)
+		parser.add_argument(
+			'--prune', action='store_true',
+			help="Delete prices whose price type doesn't match the item's type."
+		)
+
+	def handle(self, *args, **options):
+		if options['prune']:
+			count = delete_in_batches(Price.objects.exclude(price_type__item_type=F('item__item_type')))['store.Price']
+			self.stdout.write(f"Pruned {count} mismatched price(s).")
+
+		def progress(done, total):
+			self.stdout.write(f"{done}/{total} price(s) created.")
+
+		count = materialize_prices(batch_size=options['batch_size'], progress=progress)
+		self.stdout.write(self.style.SUCCESS(f"Created {count} price(s)."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.models import reconcile_reserved
+
+
+class Command(BaseCommand):
+	help = "Rebuilds the reserved quantity of every store item from open cart lines."
+
+	def handle(self, *args, **options):
+		count = reconcile_reserved()
+		self.stdout.write(self.style.SUCCESS(f"Reconciled {count} store item(s)."))
@@ -0,0 +1,67 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from customers.models import Card
+from store.benchmark import SCENARIOS, compare_to_baseline, fake_stripe, load_baseline, run_scenario, save_baseline
+from store.models import StoreItem
+from users.models import User
+
+
+class Command(BaseCommand):
+	help = "Runs the benchmark scenarios offline against data from seed_benchmark."
+
+	def add_arguments(self, parser):
+		parser.add_argument('scenarios', nargs='*', help=f"Any of: {', '.join(SCENARIOS)}. Defaults to all.")
+		parser.add_argument('--requests', type=int, default=200)
+		parser.add_argument('--users', type=int, default=10)
+		parser.add_argument('--stripe-latency', type=float, default=0.2, help="Seconds per fake Stripe call.")
+		parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmark_baseline.json'))
+		parser.add_argument('--save', action='store_true', help="Save the results as the new baseline.")
+		parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed p95 slowdown against the baseline.")
+
+	def get_data(self, options):
+		users = list(User.objects.filter(email__startswith='bench').order_by('pk')[:options['users']])
+		if not users:
+			raise CommandError("No benchmark users found. Run seed_benchmark first.")
+
+		return users, {
+			'store_items': list(
+				StoreItem.objects.filter(item__name__startswith='Bench').order_by('pk').values_list('pk', flat=True)
+			),
+			# (type, item) slug pairs that match stocked items, so the filter scenario returns rows
+			'store_filters': list(
+				StoreItem.objects.filter(item__name__startswith='Bench').order_by('item__slug')
+				.values_list('item__item_type__slug', 'item__slug').distinct()
+			),
+			'cards': dict(Card.objects.filter(user__in=users).values_list('user_id', 'pk')),
+		}
+
+	def handle(self, *args, **options):
+		unknown = set(options['scenarios']) - set(SCENARIOS)
+		if unknown:
+			raise CommandError(f"Unknown scenario(s): {', '.join(sorted(unknown))}.")
+
+		users, data = self.get_data(options)
+		results = {}
+
+		with override_settings(QUERY_BUDGET_RAISE=False), fake_stripe(options['stripe_latency']):
+			for name in options['scenarios'] or list(SCENARIOS):
+				result = run_scenario(SCENARIOS[name], users, data, options['requests'])
+				results[name] = result
+				self.stdout.write(
+					f"{name}: {result['rps']} req/s, p50 {result['p50_ms']}ms, p95 {result['p95_ms']}ms, "
+					f"p99 {result['p99_ms']}ms, {result['queries_per_request']} queries/request, {result['errors']} error(s)"
+				)
+
+		regressions = compare_to_baseline(load_baseline(options['baseline']), results, options['tolerance'])
+		for regression in regressions:
+			self.stdout.write(self.style.WARNING(f"Regression: {regression}"))
+
+		if options['save']:
+			save_baseline(options['baseline'], results)
+			self.stdout.write(self.style.SUCCESS(f"Saved baseline to {options['baseline']}."))
+		elif regressions:
+			raise CommandError(f"{len(regressions)} regression(s) against {options['baseline']}.")
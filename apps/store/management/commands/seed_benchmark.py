@@ -0,0 +1,112 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from catalog.models import Item, ItemCategory, ItemType, Parcel
+from common.signals import post_bulk_create
+from common.utils import delete_in_batches
+from customers.models import Card, Customer
+from store.models import Location, PaymentMethod, Price, PriceLevel, StoreItem, materialize_prices
+from users.models import User
+
+
+BENCHMARK_PASSWORD = 'benchmark'
+
+
+class Command(BaseCommand):
+	help = "Seeds users, items, locations and price levels for the benchmark scenarios."
+
+	def add_arguments(self, parser):
+		parser.add_argument('--users', type=int, default=50)
+		parser.add_argument('--items', type=int, default=1000)
+		parser.add_argument('--locations', type=int, default=3)
+		parser.add_argument('--price-levels', type=int, default=2)
+		parser.add_argument('--item-types', type=int, default=5)
+		parser.add_argument('--quantity', type=int, default=1000000)
+		parser.add_argument('--batch-size', type=int, default=1000)
+		parser.add_argument('--reset', action='store_true', help="Delete the data of an earlier run first.")
+
+	def get_existing(self):
+		return [
+			User.objects.filter(email__startswith='bench', email__endswith='@example.com'),
+			Item.objects.filter(name__startswith='Bench Item '),
+			Location.objects.filter(name__startswith='Bench Location '),
+			PriceLevel.objects.filter(name__startswith='Bench '),
+			ItemType.objects.filter(name__startswith='Bench Type '),
+			ItemCategory.objects.filter(name='Bench Category'),
+		]
+
+	def reset(self):
+		for qs in self.get_existing():
+			delete_in_batches(qs)
+
+	def seed_catalog(self, options):
+		item_types = [ItemType.objects.get_or_create(name=f'Bench Type {i}')[0] for i in range(options['item_types'])]
+		item_category = ItemCategory.objects.get_or_create(name='Bench Category')[0]
+		parcel = Parcel.objects.get_or_create(length=10, width=5, height=4, weight=1)[0]
+
+		items = [
+			Item(
+				item_type=item_types[i % len(item_types)], item_category=item_category, parcel=parcel,
+				name=f'Bench Item {i}', description=f'Bench Item {i} description'
+			)
+			for i in range(options['items'])
+		]
+		Item.prepare_bulk(items)
+		Item.objects.bulk_create(items, batch_size=options['batch_size'])
+		Item.set_bulk_pks(items)
+		# Indexes the items for search and bumps the catalog version
+		post_bulk_create.send(sender=Item, instances=items)
+
+		locations = [
+			Location.objects.create(
+				name=f'Bench Location {i}', line1=f'{i} Main St', city='New York', state='NY', zipcode='10001', country='US'
+			)
+			for i in range(options['locations'])
+		]
+		store_items = StoreItem.objects.bulk_create(
+			[StoreItem(item=item, location=location, quantity=options['quantity']) for item in items for location in locations],
+			batch_size=options['batch_size']
+		)
+		post_bulk_create.send(sender=StoreItem, instances=store_items)
+		return items
+
+	def seed_prices(self, options, items):
+		price_levels = [PriceLevel.objects.create(name=f'Bench {i}') for i in range(options['price_levels'])]
+		materialize_prices(price_levels=price_levels, items=Item.objects.filter(pk__in=[item.pk for item in items]))
+		for i, price_level in enumerate(price_levels):
+			Price.objects.filter(price_type__price_level=price_level, item__in=items).update(price=10 + i)
+		return price_levels
+
+	def seed_users(self, options, price_levels):
+		credit_card = PaymentMethod.objects.get_or_create(name=PaymentMethod.CREDIT_CARD)[0]
+		for i in range(options['users']):
+			user = User.objects.create_user(
+				email=f'bench{i}@example.com', username=f'bench{i}@example.com', password=BENCHMARK_PASSWORD,
+				first_name='Bench', last_name=str(i)
+			)
+			customer = Customer.objects.get_or_create(user=user)[0]
+			customer.price_level = price_levels[i % len(price_levels)] if price_levels else None
+			customer.stripe_customer_id = f'cus_bench_{i}'
+			customer.save()
+			customer.payment_methods.add(credit_card)
+
+			Card.objects.create(
+				user=user, src_id=f'src_bench_{i}', first_name='Bench', last_name=str(i), email=user.email,
+				line1=f'{i} Main St', city='New York', state='NY', zipcode='10001', country='US'
+			)
+
+	def handle(self, *args, **options):
+		if options['reset']:
+			self.reset()
+		elif any(qs.exists() for qs in self.get_existing()):
+			raise CommandError("Benchmark data already exists. Rerun with --reset to replace it.")
+
+		with transaction.atomic():
+			items = self.seed_catalog(options)
+			price_levels = self.seed_prices(options, items)
+			self.seed_users(options, price_levels)
+
+		self.stdout.write(self.style.SUCCESS(
+			f"Seeded {options['users']} user(s), {len(items)} item(s), "
+			f"{options['locations']} location(s) and {options['price_levels']} price level(s)."
+		))
@@ -0,0 +1,58 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from store.models import Order, order_totals, recompute_order_totals
+
+
+TOLERANCE = 0.005
+
+
+class Command(BaseCommand):
+	help = "Recomputes order totals from their order items and reports (or repairs) any drift."
+
+	def add_arguments(self, parser):
+		parser.add_argument('--start', help="First date ordered to check (YYYY-MM-DD).")
+		parser.add_argument('--end', help="Last date ordered to check (YYYY-MM-DD).")
+		parser.add_argument('--active', action='store_true', help="Also check open carts.")
+		parser.add_argument('--repair', action='store_true', help="Rewrite totals that have drifted.")
+
+	def parse_date(self, value, at):
+		try:
+			date = datetime.strptime(value, '%Y-%m-%d').date()
+		except ValueError:
+			raise CommandError(f"Invalid date '{value}', expected YYYY-MM-DD.")
+		return timezone.make_aware(datetime.combine(date, at))
+
+	def get_queryset(self, options):
+		placed = Q(date_ordered__isnull=False)
+		if options['start']:
+			placed &= Q(date_ordered__gte=self.parse_date(options['start'], time.min))
+		if options['end']:
+			placed &= Q(date_ordered__lte=self.parse_date(options['end'], time.max))
+
+		if options['active']:
+			placed |= Q(date_ordered__isnull=True, date_cancelled__isnull=True)
+
+		expected = {f'expected_{name}': total for name, total in order_totals().items()}
+		return Order.objects.filter(placed).annotate(**expected)
+
+	def handle(self, *args, **options):
+		drifted = []
+		qs = self.get_queryset(options).values_list(
+			'pk', 'number', 'subtotal', 'grand_total', 'expected_subtotal', 'expected_grand_total'
+		)
+
+		for pk, number, subtotal, grand_total, expected_subtotal, expected_grand_total in qs.iterator():
+			drift = grand_total - expected_grand_total
+			if abs(subtotal - expected_subtotal) > TOLERANCE or abs(drift) > TOLERANCE:
+				drifted.append(pk)
+				self.stdout.write(f"Order {number} (id {pk}): grand total {grand_total:.2f}, expected {expected_grand_total:.2f}")
+
+		if options['repair'] and drifted:
+			recompute_order_totals(drifted)
+			self.stdout.write(self.style.SUCCESS(f"Repaired {len(drifted)} order(s)."))
+		else:
+			self.stdout.write(f"{len(drifted)} order(s) have drifted.")
@@ -1,7 +1,10 @@
-from django.db import models, transaction
-from django.db.models import Manager, Sum
-from django.db.models.signals import post_delete, post_save, pre_delete
+from django.conf import settings
+from django.db import OperationalError, models, transaction
+from django.db.models import Case, Count, F, Manager, Max, Min, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.urls import reverse
@@ -9,8 +12,12 @@ from django.utils import timezone
 from django.utils.html import format_html
 
 from address.models import AbstractAddress
-from catalog.models import Item, ItemType
-from customers.models import Customer
+from catalog.models import Item, ItemType, catalog_version
+from common.models import SequenceAllocator, TrackedFieldsMixin
+from common.signals import post_batch_delete, post_bulk_create, post_bulk_update, pre_batch_delete
+from common.utils import CacheVersion, cache_is_shared, delete_in_batches, in_batch_delete, retry_on
+from customers.models import Card, Customer, ShippingAddress
+from .signals import carts_invalidated
 
 
 # Constants
@@ -19,6 +26,11 @@ REMOVE = 'Remove'
 DEFAULT_TAX = 0.07
 
 
+# Exceptions
+class InsufficientStock(ValidationError):
+	pass
+
+
 # Models
 class PaymentMethod(models.Model):
 	CREDIT_CARD = 'Credit Card'
@@ -42,17 +54,17 @@ class PostOffice(AbstractAddress):
 		return self.name
 
 
-class Location(AbstractAddress):
+class Location(TrackedFieldsMixin, AbstractAddress):
 	post_office = models.ForeignKey(PostOffice, on_delete=models.CASCADE, blank=True, null=True)
 
 	name = models.CharField(max_length=100, unique=True)
 	is_active = models.BooleanField(default=True)
 
-	def __init__(self, *args, **kwargs):
-		super().__init__(*args, **kwargs)
-		self.initial_is_active = self.is_active
-		if self.pk is None:
-			self.initial_is_active = False
+	tracked_fields = ('is_active',)
+
+	@property
+	def initial_is_active(self):
+		return False if self._state.adding else self.get_initial('is_active')
 
 	def __str__(self):
 		return self.name
@@ -63,6 +75,7 @@ class StoreItem(models.Model):
 	location = models.ForeignKey(Location, on_delete=models.CASCADE)
 
 	quantity = models.PositiveIntegerField(default=0)
+	reserved = models.IntegerField('Reserved in carts', default=0, editable=False)
 
 	class Meta:
 		unique_together = ('item', 'location')
@@ -81,16 +94,7 @@ class StoreItem(models.Model):
 		return super().clean_fields(exclude=None)
 
 	def quantity_in_carts(self):
-		cart_quantity = 0
-
-		total = OrderItem.objects.filter(
-			store_item=self, order__date_ordered__isnull=True, order__date_cancelled__isnull=True
-		).aggregate(Sum('quantity'))['quantity__sum']
-
-		if total:
-			cart_quantity = total
-
-		return self.quantity - cart_quantity
+		return self.quantity - self.reserved
 
 	def quantity_dropdown(self):
 		quantity = self.quantity_in_carts()
@@ -103,7 +107,7 @@ class StoreItem(models.Model):
 		return self.quantity > 0
 
 
-class InventoryRecord(models.Model):
+class InventoryRecord(TrackedFieldsMixin, models.Model):
 	CHOICES = [
 		[ADD, ADD],
 		[REMOVE, REMOVE]
@@ -121,11 +125,11 @@ class InventoryRecord(models.Model):
 		verbose_name = 'Inventory Records'
 		verbose_name_plural = 'Inventory Records'
 
-	def __init__(self, *args, **kwargs):
-		super().__init__(*args, **kwargs)
-		self.init_quantity = self.quantity
-		if self.pk is None:
-			self.init_quantity = 0
+	tracked_fields = ('quantity',)
+
+	@property
+	def init_quantity(self):
+		return self.get_initial('quantity') or 0
 
 	def __str__(self):
 		return f"{self.option} {self.quantity}: {self.store_item}"
@@ -142,6 +146,12 @@ class InventoryRecord(models.Model):
 	def quantity_change(self):
 		return self.quantity - self.init_quantity
 
+	@retry_on(OperationalError)
+	def save(self, *args, **kwargs):
+		# Keeps the record and its stock change in one transaction
+		with transaction.atomic():
+			super().save(*args, **kwargs)
+
 
 class PriceLevel(models.Model):
 	name = models.CharField(max_length=10)
@@ -217,27 +227,118 @@ class CustomPrice(models.Model):
 		return f"${self.price} - {self.item}"
 
 
-def get_user_price(user, item):
-	qs = CustomPrice.objects.filter(user=user, item=item)
-	if qs.exists():
-		return qs[0].price
+# Prices
+# Resolved prices only go through the cache when it's shared. Saves and deletes
+# drop the cached price, and a per-process copy that missed the drop would put
+# the old price on cart lines that no later reprice corrects.
+PRICE_CACHE_TIMEOUT = getattr(settings, 'PRICE_CACHE_TIMEOUT', 60)
+
+
+def custom_price_key(user_id, item_id):
+	return f"store:custom_price:{user_id}:{item_id}"
+
+
+def level_price_key(price_level_id, item_id):
+	return f"store:price:{price_level_id}:{item_id}"
+
+
+# Resolves prices keyed by (user, price level, item). Lookups are memoized on the
+# instance for a request/batch, and shared across workers through the cache when
+# it is shared. Missing prices are cached as None so they don't hit the database
+# again.
+class PriceResolver:
+	def __init__(self):
+		self.memo = {}
+		self.use_cache = cache_is_shared()
+
+	def lookup(self, pairs, make_key, fetch):
+		keys = {make_key(*pair): pair for pair in pairs}
+		prices = {k: self.memo[k] for k in keys if k in self.memo}
+
+		missing = [k for k in keys if k not in prices]
+		if missing and self.use_cache:
+			prices.update(cache.get_many(missing))
+			missing = [k for k in missing if k not in prices]
+
+		if missing:
+			scope_ids = {keys[k][0] for k in missing}
+			item_ids = {keys[k][1] for k in missing}
+			found = dict.fromkeys(missing)
+			for scope_id, item_id, price in fetch(scope_ids, item_ids):
+				key = make_key(scope_id, item_id)
+				if key in found:
+					found[key] = price
+
+			if self.use_cache:
+				cache.set_many(found, PRICE_CACHE_TIMEOUT)
+			prices.update(found)
+
+		self.memo.update(prices)
+		return {pair: prices[k] for k, pair in keys.items()}
+
+	def custom_prices(self, pairs):
+		return self.lookup(pairs, custom_price_key, lambda user_ids, item_ids: (
+			CustomPrice.objects.filter(user_id__in=user_ids, item_id__in=item_ids)
+			.order_by('-pk').values_list('user_id', 'item_id', 'price')
+		))
+
+	def level_prices(self, pairs):
+		return self.lookup(pairs, level_price_key, lambda level_ids, item_ids: (
+			Price.objects.filter(price_type__price_level_id__in=level_ids, item_id__in=item_ids)
+			.order_by('-pk').values_list('price_type__price_level_id', 'item_id', 'price')
+		))
+
+	def resolve(self, keys):
+		keys = set(keys)
+		custom = self.custom_prices({(user_id, item_id) for user_id, level_id, item_id in keys})
+
+		fallback = {(level_id, item_id) for user_id, level_id, item_id in keys if custom[(user_id, item_id)] is None}
+		level = self.level_prices(fallback)
+
+		prices = {}
+		for user_id, level_id, item_id in keys:
+			price = custom[(user_id, item_id)]
+			if price is None:
+				price = level[(level_id, item_id)]
+			prices[(user_id, level_id, item_id)] = price or 0
+		return prices
+
+
+def get_user_prices(user, items, resolver=None):
+	resolver = resolver or PriceResolver()
+	level_id = user.customer.price_level_id
+	item_ids = [getattr(item, 'pk', item) for item in items]
+
+	prices = resolver.resolve((user.pk, level_id, item_id) for item_id in item_ids)
+	return {item_id: prices[(user.pk, level_id, item_id)] for item_id in item_ids}
 
-	qs = Price.objects.filter(price_type__price_level=user.customer.price_level, item=item)
-	if qs.exists():
-		return qs[0].price
 
-	return 0
+def get_user_price(user, item, resolver=None):
+	return get_user_prices(user, [item], resolver)[item.pk]
+
+
+order_numbers = SequenceAllocator(
+	'store.order',
+	block_size=getattr(settings, 'ORDER_NUMBER_BLOCK_SIZE', 1),
+	initial=lambda: Order.objects.aggregate(Max('number'))['number__max'] or 0
+)
 
 
 class OrderManager(Manager):
+	ACTIVE = {
+		'date_ordered__isnull': True,
+		'date_paid__isnull': True,
+		'date_cancelled__isnull': True,
+		'date_recieved__isnull': True,
+	}
+
+	def active(self):
+		return self.get_queryset().filter(**self.ACTIVE)
+
+	# Races on creation end in the unique_active_order constraint, which
+	# get_or_create recovers from by reading the winner's cart.
 	def get_or_create_active(self, user):
-		obj, created = Order.objects.get_or_create(
-			user=user,
-			date_ordered__isnull=True,
-			date_paid__isnull=True,
-			date_cancelled__isnull=True,
-			date_recieved__isnull=True
-		)
+		obj, created = Order.objects.get_or_create(user=user, **self.ACTIVE)
 		return [obj, created]
 
 	def past(self, user):
@@ -281,21 +382,23 @@ class Order(models.Model):
 
 	objects = OrderManager()
 
-	def __init__(self, *args, **kwargs):
-		super().__init__(*args, **kwargs)
-		if self.pk is None:
-			self.set_number()
+	class Meta:
+		constraints = [
+			# One open cart per user. The partial index also serves the active cart lookup.
+			models.UniqueConstraint(fields=['user'], condition=Q(**OrderManager.ACTIVE), name='unique_active_order'),
+		]
 
 	def __str__(self):
 		return f"{self.user} | {self.number}"
 
 	def set_number(self):
-		number = 0
-		qs = Order.objects.filter(number__isnull=False).order_by('-number')
+		self.number = order_numbers.next()
 
-		if qs.exists():
-			number = qs[0].number + 1		
-		self.number = number
+	def save(self, *args, **kwargs):
+		if self.pk is None and self.number is None:
+			self.set_number()
+
+		super().save(*args, **kwargs)
 
 	def is_active(self):
 		return self.date_ordered is None and self.date_cancelled is None
@@ -314,24 +417,20 @@ class Order(models.Model):
 		info = ', '.join(info_list)
 		return info
 
-	def update_subtotal(self):
-		subtotal = 0
-		for order_item in self.orderitem_set.all():
-			subtotal += order_item.total
-
-		self.subtotal = subtotal
-		return self.subtotal
-
-	def update_shipping_total(self):
-		return self.shipping_total
+	def release_reserved(self):
+		changes = {}
+		for store_item_id, quantity in self.orderitem_set.values_list('store_item_id', 'quantity'):
+			changes[store_item_id] = changes.get(store_item_id, 0) - quantity
+		adjust_reserved(changes)
 
-	def update_tax(self):
-		self.tax = (self.subtotal + self.shipping_total) * DEFAULT_TAX
-		return self.tax
+	def add_to_subtotal(self, amount):
+		if amount:
+			Order.objects.filter(pk=self.pk).update(**total_changes(amount))
 
-	def update_grand_total(self):
-		self.grand_total = self.update_subtotal() + self.update_shipping_total() + self.update_tax()
-		self.save()
+			tax = amount * DEFAULT_TAX
+			self.subtotal += amount
+			self.tax += tax
+			self.grand_total += amount + tax
 
 	def pre_payment(self, card):
 		self.orderitem_set.filter(quantity__lt=1).delete()
@@ -339,24 +438,22 @@ class Order(models.Model):
 		credit_card = PaymentMethod.CHOICES[1][0]
 		self.payment_method = PaymentMethod.objects.get_or_create(name=credit_card)[0]
 		self.card = card
-		self.save()
+		self.save(update_fields=['payment_method', 'card'])
 
+	@retry_on(OperationalError, attempts=10)
+	@transaction.atomic
 	def make_payment(self, payment_intent_id):
 		self.payment_intent_id = payment_intent_id
 		self.date_ordered = timezone.now()
 		self.date_paid = timezone.now()
-		self.save()
-
-		for order_item in self.orderitem_set.filter(quantity__gt=0):
-			InventoryRecord.objects.create(
-				order_item=order_item,
-				store_item=order_item.store_item,
-				option=REMOVE,
-				quantity=order_item.quantity
-			)
+		self.save(update_fields=['payment_intent_id', 'date_ordered', 'date_paid'])
+		self.release_reserved()
+		if not post_order_inventory(self):
+			# Another checkout took the stock and emptied this cart meanwhile
+			raise InsufficientStock("The items in this cart are no longer available.")
 
 
-class OrderItem(models.Model):
+class OrderItem(TrackedFieldsMixin, models.Model):
 	order = models.ForeignKey(Order, on_delete=models.CASCADE)
 	store_item = models.ForeignKey(StoreItem, verbose_name='Item w/Location', on_delete=models.CASCADE)
 	shipping_address = models.ForeignKey('customers.ShippingAddress', on_delete=models.CASCADE, blank=True, null=True)
@@ -368,9 +465,15 @@ class OrderItem(models.Model):
 	class Meta:
 		unique_together = ('order', 'store_item',)
 
-	def __init__(self, *args, **kwargs):
-		super().__init__(*args, **kwargs)
-		self.init_quantity = self.quantity
+	tracked_fields = ('quantity', 'total')
+
+	@property
+	def init_quantity(self):
+		return self.get_initial('quantity')
+
+	@property
+	def init_total(self):
+		return self.get_initial('total')
 
 	def __str__(self):
 		return f"{self.store_item.item}: {self.quantity}"
@@ -378,6 +481,9 @@ class OrderItem(models.Model):
 	def quantity_dif(self):
 		return self.quantity-self.init_quantity
 
+	def total_dif(self):
+		return self.total-self.init_total
+
 	def clean_fields(self, exclude=None):
 		if self.quantity_dif() > self.store_item.quantity_in_carts():
 			raise ValidationError("Not enough to add.")
@@ -396,110 +502,543 @@ class OrderItem(models.Model):
 
 
 # Signals
+@receiver(post_save, sender=StoreItem, dispatch_uid="store_item_saved_catalog_version")
+@receiver(post_delete, sender=StoreItem, dispatch_uid="store_item_deleted_catalog_version")
+@receiver(post_save, sender=Location, dispatch_uid="location_saved_catalog_version")
+@receiver(post_delete, sender=Location, dispatch_uid="location_deleted_catalog_version")
+@receiver(post_bulk_update, sender=StoreItem, dispatch_uid="store_items_bulk_updated_catalog_version")
+def store_bump_catalog_version(sender, **kwargs):
+	catalog_version.bump()
+
+
 @receiver(post_save, sender=InventoryRecord, dispatch_uid="inv_record_updated")
 def inv_record_updated(sender, instance, created, **kwargs):
-	store_item = instance.store_item
+	quantity_change = instance.quantity_change()
 
 	if instance.option == ADD:
-		store_item.quantity += instance.quantity_change()
+		change_stock({instance.store_item_id: quantity_change})
 	else:
-		quantity_change = instance.quantity_change()
-		store_item.quantity -= quantity_change
+		change_stock({instance.store_item_id: -quantity_change})
 
 		if quantity_change > 0:
-			# Didn't use update to activate signal on save
-			qs = OrderItem.objects.filter(store_item=instance.store_item, order__date_ordered__isnull=True, order__date_cancelled__isnull=True)
-			for order_item in qs:
-				order_item.quantity = 0
-				order_item.save()
-
-	store_item.save()
+			invalidate_open_carts([instance.store_item_id])
 
 
 @receiver(pre_delete, sender=InventoryRecord, dispatch_uid="inv_record_deleted")
 def inv_record_deleted(sender, instance, **kwargs):
-	store_item = instance.store_item
-
+	if in_batch_delete():
+		return
 	if instance.option == ADD:
-		store_item.quantity -= instance.quantity
+		change_stock({instance.store_item_id: -instance.quantity})
 	else:
-		store_item.quantity += instance.quantity
-	
-	store_item.save()
+		change_stock({instance.store_item_id: instance.quantity})
 
 
 @receiver(post_save, sender=PriceLevel, dispatch_uid="price_level_created")
 def price_level_created(sender, instance, created, **kwargs):
 	if created:
-		for item_type in ItemType.objects.all():
-			price_type = PriceType.objects.create(item_type=item_type, price_level=instance)
-
-			for item in Item.objects.all():
-				Price.objects.create(price_type=price_type, item=item)
+		materialize_prices(price_levels=[instance], item_types=ItemType.objects.all())
 
 
 @receiver(post_save, sender=Customer, dispatch_uid="price_level_changed")
 def price_level_changed(sender, instance, **kwargs):
-	if instance.old_price_level != instance.price_level:
-		qs = OrderItem.objects.filter(
-			order__user__customer=instance,
-			order__date_ordered__isnull=True,
-			order__date_paid__isnull=True,
-		)
-
-		for order_item in qs:
-			new_price = Price.objects.get(
-				item=order_item.store_item.item,
-				price_type__price_level=instance.price_level
-			).price
-			order_item.price = new_price
-			order_item.save()
+	if instance.has_changed('price_level'):
+		reprice_open_orders(user=instance.user)
 
 
 @receiver(post_save, sender='catalog.Item', dispatch_uid="item_created_create_price")
 def item_created_create_price(sender, instance, created, **kwargs):
 	if created:
-		for level in PriceLevel.objects.all():
-			price_type = PriceType.objects.get_or_create(item_type=instance.item_type, price_level=level)[0]
-			Price.objects.create(price_type=price_type, item=instance)
+		materialize_prices(items=Item.objects.filter(pk=instance.pk))
+
+
+@receiver(post_bulk_create, sender='catalog.Item', dispatch_uid="items_bulk_created_create_prices")
+def items_bulk_created_create_prices(sender, instances, **kwargs):
+	materialize_prices(items=Item.objects.filter(pk__in=[item.pk for item in instances]))
 
 
 @receiver(post_save, sender=OrderItem, dispatch_uid="update_total")
 def update_total(sender, instance, created, **kwargs):
 	if instance.order.is_active():
-		instance.order.update_grand_total()
+		instance.order.add_to_subtotal(instance.total_dif())
+		adjust_reserved({instance.store_item_id: instance.quantity_dif()})
+
+
+@receiver(post_delete, sender=OrderItem, dispatch_uid="delete_update_total")
+def delete_update_total(sender, instance, **kwargs):
+	if in_batch_delete():
+		return
+	is_active = Order.objects.filter(
+		pk=instance.order_id, date_ordered__isnull=True, date_cancelled__isnull=True
+	).update(**total_changes(-instance.init_total))
 
+	if is_active:
+		adjust_reserved({instance.store_item_id: -instance.init_quantity})
 
 
-def update_prices(item, price):
+# Price matrix
+MATERIALIZE_BATCH_SIZE = 1000
+
+
+def get_or_create_price_types(level_ids, item_type_ids):
+	def price_type_map():
+		qs = PriceType.objects.filter(price_level_id__in=level_ids, item_type_id__in=item_type_ids)
+		return {(t, l): pk for pk, t, l in qs.values_list('pk', 'item_type_id', 'price_level_id')}
+
+	price_types = price_type_map()
+	missing = [
+		PriceType(item_type_id=t, price_level_id=l)
+		for l in level_ids for t in item_type_ids if (t, l) not in price_types
+	]
+	if missing:
+		PriceType.objects.bulk_create(missing, batch_size=MATERIALIZE_BATCH_SIZE)
+		price_types = price_type_map()
+	return price_types
+
+
+# Creates the missing Price rows for each item under its own item type's price
+# types, in chunked bulk inserts inside one transaction. progress(done, total)
+# is called after each chunk.
+def materialize_prices(price_levels=None, items=None, item_types=None, batch_size=MATERIALIZE_BATCH_SIZE, progress=None):
+	level_ids = [level.pk for level in (PriceLevel.objects.all() if price_levels is None else price_levels)]
+	items = Item.objects.all() if items is None else items
+	item_type_ids = set(items.values_list('item_type_id', flat=True).distinct())
+	if item_types is not None:
+		item_type_ids.update(item_type.pk for item_type in item_types)
+
+	created = 0
+	with transaction.atomic():
+		price_types = get_or_create_price_types(level_ids, item_type_ids)
+		existing = set(
+			Price.objects.filter(price_type_id__in=price_types.values(), item__in=items)
+			.values_list('price_type_id', 'item_id')
+		)
+
+		total = items.count() * len(level_ids) - len(existing)
+		batch = []
+		for item_id, item_type_id in items.order_by('pk').values_list('pk', 'item_type_id').iterator():
+			for level_id in level_ids:
+				price_type_id = price_types[(item_type_id, level_id)]
+				if (price_type_id, item_id) not in existing:
+					batch.append(Price(price_type_id=price_type_id, item_id=item_id))
+
+			if len(batch) >= batch_size:
+				Price.objects.bulk_create(batch, batch_size=batch_size)
+				created += len(batch)
+				batch = []
+				if progress:
+					progress(created, total)
+
+		if batch:
+			Price.objects.bulk_create(batch, batch_size=batch_size)
+			created += len(batch)
+			if progress:
+				progress(created, total)
+
+	return created
+
+
+# Order totals
+TOTALS_BATCH_SIZE = 500
+
+
+def total_changes(amount):
+	tax = amount * DEFAULT_TAX
+	return {
+		'subtotal': F('subtotal') + amount,
+		'tax': F('tax') + tax,
+		'grand_total': F('grand_total') + amount + tax,
+	}
+
+
+# An order's totals computed from its items, as expressions on Order
+def order_totals():
+	subtotal = Coalesce(
+		Subquery(
+			OrderItem.objects.filter(order=OuterRef('pk'))
+			.values('order').annotate(total=Sum('total')).values('total')
+		),
+		Value(0),
+		output_field=models.FloatField()
+	)
+	tax = (subtotal + F('shipping_total')) * DEFAULT_TAX
+	return {'subtotal': subtotal, 'tax': tax, 'grand_total': subtotal + F('shipping_total') + tax}
+
+
+def recompute_order_totals(order_ids):
+	count = 0
+	order_ids = list(order_ids)
+	for i in range(0, len(order_ids), TOTALS_BATCH_SIZE):
+		count += Order.objects.filter(pk__in=order_ids[i:i+TOTALS_BATCH_SIZE]).update(**order_totals())
+	return count
+
+
+# Reserved quantities
+def adjust_reserved(changes):
+	changes = {pk: amount for pk, amount in changes.items() if amount}
+	if changes:
+		StoreItem.objects.filter(pk__in=changes).update(reserved=F('reserved') + Case(
+			*[When(pk=pk, then=Value(amount)) for pk, amount in changes.items()],
+			default=Value(0)
+		))
+
+
+def reconcile_reserved(store_items=None):
+	qs = StoreItem.objects.all() if store_items is None else store_items
+	in_carts = Coalesce(
+		Subquery(
+			OrderItem.objects.filter(
+				store_item=OuterRef('pk'), order__date_ordered__isnull=True, order__date_cancelled__isnull=True
+			).values('store_item').annotate(total=Sum('quantity')).values('total')
+		),
+		Value(0)
+	)
+
+	with transaction.atomic():
+		drifted = qs.annotate(in_carts=in_carts).exclude(reserved=F('in_carts')).count()
+		qs.update(reserved=in_carts)
+	return drifted
+
+
+# Stock
+# Applies {store_item_id: amount} in one conditional UPDATE. Rows that would go
+# below zero are left untouched, which rolls back the whole change.
+@retry_on(OperationalError)
+def change_stock(changes):
+	changes = {pk: amount for pk, amount in changes.items() if amount}
+	if not changes:
+		return
+
+	with transaction.atomic():
+		updated = StoreItem.objects.filter(
+			pk__in=changes,
+			quantity__gte=Case(*[When(pk=pk, then=Value(-amount)) for pk, amount in changes.items()], default=Value(0))
+		).update(quantity=F('quantity') + Case(
+			*[When(pk=pk, then=Value(amount)) for pk, amount in changes.items()],
+			default=Value(0)
+		))
+
+		if updated != len(changes):
+			raise InsufficientStock("Unable to remove the entered amount. Not enough of the item in stock.")
+		catalog_version.bump()
+		invalidate_cart_profiles(changes)
+
+
+# Profiles
+# /store/user/ is cached per user under the user's own version, and only with a
+# shared cache. Changes to anything a profile shows bump the version of the
+# users it shows up for; the timeout covers catalog edits to carted items.
+PROFILE_CACHE_TIMEOUT = 60 * 5
+
+
+def profile_version(user_id):
+	return CacheVersion(f"store:profile:{user_id}")
+
+
+def profile_key(user_id):
+	return f"store:profile:{user_id}:{profile_version(user_id).get()}"
+
+
+def invalidate_profiles(user_ids):
+	if not cache_is_shared():
+		return
+	for user_id in set(user_ids):
+		profile_version(user_id).bump()
+
+
+# Carts show the stock of their store items
+def invalidate_cart_profiles(store_item_ids):
+	invalidate_profiles(
+		Order.objects.filter(
+			orderitem__store_item__in=list(store_item_ids),
+			date_ordered__isnull=True,
+			date_cancelled__isnull=True
+		).values_list('user_id', flat=True).distinct()
+	)
+
+
+# Cart invalidation
+# Zeroes the open cart lines of the given store items. With exceeding_stock,
+# only the lines asking for more than is left in stock.
+def invalidate_open_carts(store_item_ids, exceeding_stock=False):
+	store_item_ids = list(store_item_ids)
+	qs = OrderItem.objects.filter(
+		store_item__in=store_item_ids,
+		order__date_ordered__isnull=True,
+		order__date_cancelled__isnull=True,
+		quantity__gt=0
+	)
+	if exceeding_stock:
+		qs = qs.filter(quantity__gt=F('store_item__quantity'))
+
+	with transaction.atomic():
+		orders = dict(qs.values_list('order_id', 'order__user_id'))
+		order_ids = set(orders)
+		count = qs.update(quantity=0, total=0)
+		recompute_order_totals(order_ids)
+		if not exceeding_stock:
+			StoreItem.objects.filter(pk__in=store_item_ids).update(reserved=0)
+		elif count:
+			reconcile_reserved(StoreItem.objects.filter(pk__in=store_item_ids))
+		invalidate_profiles(orders.values())
+
+	if count:
+		carts_invalidated.send(sender=StoreItem, store_item_ids=store_item_ids, order_ids=order_ids, count=count)
+	return count
+
+
+# Duplicate carts
+# Folds every user's extra open carts into their oldest one, so existing data
+# satisfies unique_active_order. Lines for the same store item are summed.
+def collapse_duplicate_carts():
+	duplicates = (
+		Order.objects.active().values('user')
+		.annotate(count=Count('pk'), keep=Min('pk')).filter(count__gt=1).values_list('keep', 'user')
+	)
+
+	collapsed = 0
+	with transaction.atomic():
+		for keep, user_id in list(duplicates):
+			extra = Order.objects.active().filter(user=user_id).exclude(pk=keep)
+			kept_lines = dict(OrderItem.objects.filter(order=keep).values_list('store_item_id', 'pk'))
+			store_item_ids = set(kept_lines)
+
+			lines = OrderItem.objects.filter(order__in=extra).values_list('pk', 'store_item_id', 'quantity')
+			for pk, store_item_id, quantity in lines:
+				store_item_ids.add(store_item_id)
+				if store_item_id in kept_lines:
+					OrderItem.objects.filter(pk=kept_lines[store_item_id]).update(
+						quantity=F('quantity') + quantity, total=(F('quantity') + quantity) * F('price')
+					)
+				else:
+					OrderItem.objects.filter(pk=pk).update(order=keep)
+					kept_lines[store_item_id] = pk
+
+			collapsed += delete_in_batches(extra)['store.Order']
+			recompute_order_totals([keep])
+			reconcile_reserved(StoreItem.objects.filter(pk__in=store_item_ids))
+			invalidate_profiles([user_id])
+	return collapsed
+
+
+# Inventory ledger
+def post_order_inventory(order):
+	lines = order.orderitem_set.filter(quantity__gt=0).values_list(
+		'pk', 'store_item_id', 'store_item__location_id', 'quantity'
+	)
+
+	records, locations = [], {}
+	for pk, store_item_id, location_id, quantity in lines:
+		records.append(InventoryRecord(order_item_id=pk, store_item_id=store_item_id, option=REMOVE, quantity=quantity))
+		changes = locations.setdefault(location_id, {})
+		changes[store_item_id] = changes.get(store_item_id, 0) + quantity
+
+	with transaction.atomic():
+		InventoryRecord.objects.bulk_create(records)
+		for changes in locations.values():
+			change_stock({pk: -quantity for pk, quantity in changes.items()})
+
+		invalidate_open_carts({pk for changes in locations.values() for pk in changes}, exceeding_stock=True)
+	return records
+
+
+# Repricing
+REPRICE_BATCH_SIZE = 500
+
+
+def reprice_open_orders(item=None, user=None, price_level=None, resolver=None):
+	resolver = resolver or PriceResolver()
 	qs = OrderItem.objects.filter(
 		order__date_ordered__isnull=True,
 		order__date_paid__isnull=True,
-		store_item__item=item
+		order__date_cancelled__isnull=True
 	)
+	if item is not None:
+		qs = qs.filter(store_item__item=item)
+	if user is not None:
+		qs = qs.filter(order__user=user)
+	if price_level is not None:
+		qs = qs.filter(order__user__customer__price_level=price_level)
+
+	lines = list(qs.values_list(
+		'pk', 'order_id', 'order__user_id', 'order__user__customer__price_level_id',
+		'store_item__item_id', 'quantity', 'price', 'total'
+	))
+	prices = resolver.resolve((line[2], line[3], line[4]) for line in lines)
+
+	order_items, order_ids = [], set()
+	for pk, order_id, user_id, level_id, item_id, quantity, old_price, old_total in lines:
+		price = prices[(user_id, level_id, item_id)]
+		total = quantity * price
+		if price != old_price or total != old_total:
+			order_items.append(OrderItem(pk=pk, price=price, total=total))
+			order_ids.add(order_id)
+
+	if not order_items:
+		return {'order_items': 0, 'orders': 0}
 
 	with transaction.atomic():
-		for order_item in qs:
-			order_item.price = price
-			order_item.save()
+		OrderItem.objects.bulk_update(order_items, ['price', 'total'], batch_size=REPRICE_BATCH_SIZE)
+		recompute_order_totals(order_ids)
+		invalidate_profiles(line[2] for line in lines if line[1] in order_ids)
+
+	return {'order_items': len(order_items), 'orders': len(order_ids)}
 
 
 @receiver(post_save, sender=CustomPrice, dispatch_uid="save_update_custom_prices")
 def save_update_custom_prices(sender, instance, created, **kwargs):
-	update_prices(instance.item, instance.price)
+	cache.delete(custom_price_key(instance.user_id, instance.item_id))
+	reprice_open_orders(item=instance.item, user=instance.user)
 
 
 @receiver(post_save, sender=Price, dispatch_uid="save_update_prices")
 def save_update_prices(sender, instance, created, **kwargs):
-	update_prices(instance.item, instance.price)
+	price_level_id = instance.price_type.price_level_id
+	cache.delete(level_price_key(price_level_id, instance.item_id))
+	reprice_open_orders(item=instance.item, price_level=price_level_id)
 
 
 @receiver(post_delete, sender=CustomPrice, dispatch_uid="delete_update_prices")
 def delete_update_prices(sender, instance, **kwargs):
-	price = Price.objects.get(
-		item=instance.item,
-		price_type__price_level=instance.user.customer.price_level
-	).price
+	if in_batch_delete():
+		return
+	cache.delete(custom_price_key(instance.user_id, instance.item_id))
+	reprice_open_orders(item=instance.item, user=instance.user)
+
+
+@receiver(post_delete, sender=Price, dispatch_uid="delete_drop_price")
+def delete_drop_price(sender, instance, **kwargs):
+	if in_batch_delete():
+		return
+	price_level_id = PriceType.objects.filter(pk=instance.price_type_id).values_list('price_level_id', flat=True).first()
+	cache.delete(level_price_key(price_level_id, instance.item_id))
+
+
+# Batch deletes
+# The per-row delete receivers above stand down inside delete_in_batches; these
+# apply the same bookkeeping once per batch from the collected instances.
+def collected_pks(collector, model):
+	return {obj.pk for obj in collector.data.get(model, ())}
+
+
+@receiver(pre_batch_delete, dispatch_uid="batch_reverse_inventory")
+def batch_reverse_inventory(sender, collector, **kwargs):
+	deleted_store_items = collected_pks(collector, StoreItem)
+	changes = {}
+	for record in collector.data.get(InventoryRecord, ()):
+		if record.store_item_id not in deleted_store_items:
+			amount = -record.quantity if record.option == ADD else record.quantity
+			changes[record.store_item_id] = changes.get(record.store_item_id, 0) + amount
+	change_stock(changes)
+
+
+@receiver(post_batch_delete, dispatch_uid="batch_update_totals")
+def batch_update_totals(sender, collector, **kwargs):
+	order_items = collector.data.get(OrderItem, ())
+	if not order_items:
+		return
+
+	order_ids = {obj.order_id for obj in order_items} - collected_pks(collector, Order)
+	store_item_ids = {obj.store_item_id for obj in order_items} - collected_pks(collector, StoreItem)
+	active = Order.objects.filter(pk__in=order_ids, date_ordered__isnull=True, date_cancelled__isnull=True)
+	recompute_order_totals(active.values_list('pk', flat=True))
+	if store_item_ids:
+		reconcile_reserved(StoreItem.objects.filter(pk__in=store_item_ids))
+
+
+# Runs before the delete, while the price types are still there to read
+@receiver(pre_batch_delete, dispatch_uid="batch_drop_prices")
+def batch_drop_prices(sender, collector, **kwargs):
+	prices = collector.data.get(Price, ())
+	if not prices:
+		return
+
+	levels = dict(
+		PriceType.objects.filter(pk__in={obj.price_type_id for obj in prices}).values_list('pk', 'price_level_id')
+	)
+	cache.delete_many([level_price_key(levels.get(obj.price_type_id), obj.item_id) for obj in prices])
+
+
+@receiver(post_batch_delete, dispatch_uid="batch_update_prices")
+def batch_update_prices(sender, collector, **kwargs):
+	custom_prices = collector.data.get(CustomPrice, ())
+	if not custom_prices:
+		return
+
+	cache.delete_many([custom_price_key(obj.user_id, obj.item_id) for obj in custom_prices])
+	deleted_items = collected_pks(collector, Item)
+	for user_id, item_id in {(obj.user_id, obj.item_id) for obj in custom_prices}:
+		if item_id not in deleted_items:
+			reprice_open_orders(item=item_id, user=user_id)
+
+
+# Profile invalidation
+@receiver(post_save, sender='users.User', dispatch_uid="user_saved_profile")
+def user_saved_profile(sender, instance, **kwargs):
+	invalidate_profiles([instance.pk])
+
+
+@receiver(post_save, sender=Customer, dispatch_uid="customer_saved_profile")
+@receiver(post_delete, sender=Customer, dispatch_uid="customer_deleted_profile")
+@receiver(post_save, sender=Card, dispatch_uid="card_saved_profile")
+@receiver(post_delete, sender=Card, dispatch_uid="card_deleted_profile")
+@receiver(post_save, sender=ShippingAddress, dispatch_uid="shipping_address_saved_profile")
+@receiver(post_delete, sender=ShippingAddress, dispatch_uid="shipping_address_deleted_profile")
+@receiver(post_save, sender=Order, dispatch_uid="order_saved_profile")
+@receiver(post_delete, sender=Order, dispatch_uid="order_deleted_profile")
+def user_record_changed_profile(sender, instance, **kwargs):
+	if not in_batch_delete():
+		invalidate_profiles([instance.user_id])
+
+
+@receiver(post_save, sender=OrderItem, dispatch_uid="order_item_saved_profile")
+@receiver(post_delete, sender=OrderItem, dispatch_uid="order_item_deleted_profile")
+def order_item_changed_profile(sender, instance, **kwargs):
+	if in_batch_delete():
+		return
+	if OrderItem.order.is_cached(instance):
+		invalidate_profiles([instance.order.user_id])
+	else:
+		invalidate_profiles(Order.objects.filter(pk=instance.order_id).values_list('user_id', flat=True))
+
+
+@receiver(m2m_changed, sender=Customer.payment_methods.through, dispatch_uid="payment_methods_changed_profile")
+def payment_methods_changed_profile(sender, instance, action, reverse, pk_set, **kwargs):
+	if not reverse:
+		if action in ('post_add', 'post_remove', 'post_clear'):
+			invalidate_profiles([instance.user_id])
+	elif action in ('post_add', 'post_remove'):
+		invalidate_profiles(Customer.objects.filter(pk__in=pk_set).values_list('user_id', flat=True))
+	elif action == 'pre_clear':
+		invalidate_profiles(Customer.objects.filter(payment_methods=instance).values_list('user_id', flat=True))
+
+
+@receiver(post_save, sender=StoreItem, dispatch_uid="store_item_saved_profile")
+def store_item_saved_profile(sender, instance, created, **kwargs):
+	if not created:
+		invalidate_cart_profiles([instance.pk])
+
+
+@receiver(post_bulk_update, sender=StoreItem, dispatch_uid="store_items_bulk_updated_profile")
+def store_items_bulk_updated_profile(sender, instances, **kwargs):
+	invalidate_cart_profiles(obj.pk for obj in instances)
+
+
+# Profiles show price level and payment method names
+@receiver(post_save, sender=PriceLevel, dispatch_uid="price_level_saved_profile")
+@receiver(post_save, sender=PaymentMethod, dispatch_uid="payment_method_saved_profile")
+def customer_option_saved_profile(sender, instance, created, **kwargs):
+	if not created:
+		field = 'price_level' if sender is PriceLevel else 'payment_methods'
+		invalidate_profiles(Customer.objects.filter(**{field: instance}).values_list('user_id', flat=True))
 
-	update_prices(instance.item, price)
 
+@receiver(post_batch_delete, dispatch_uid="batch_invalidate_profiles")
+def batch_invalidate_profiles(sender, collector, **kwargs):
+	user_ids = {
+		obj.user_id for model in (Customer, Card, ShippingAddress, Order) for obj in collector.data.get(model, ())
+	}
+	order_ids = {obj.order_id for obj in collector.data.get(OrderItem, ())} - collected_pks(collector, Order)
+	if order_ids:
+		user_ids.update(Order.objects.filter(pk__in=order_ids).values_list('user_id', flat=True))
+	invalidate_profiles(user_ids)
@@ -1,11 +1,14 @@
+from django.db.models import Prefetch
 from rest_framework import serializers
 
 from users.models import User
-from customers.models import Card, Customer
+from catalog.models import Item
+from common.serializers import apply_query_plan
+from customers.models import Card, Customer, ShippingAddress
 from customers.serializers import CardSerializer, ShippingAddressSerializer
 
 from .models import *
-from .utils import stripe_make_payment
+from .utils import stripe_make_payment, stripe_refund
 
 
 # Catalog
@@ -27,11 +30,6 @@ class StoreItemSerializer(serializers.ModelSerializer):
 			'quantity': {'read_only': True}
 		}
 
-	def __init__(self, *args, **kwargs):
-		super().__init__(*args, **kwargs)
-		if self.context['request'].method == 'GET':
-			self.Meta.depth = 1
-
 	def validate_location(self, value):
 		location = Location.objects.update_or_create(
 			name=value['name'],
@@ -47,6 +45,21 @@ class StoreItemSerializer(serializers.ModelSerializer):
 		return location
 
 
+class ItemFieldsSerializer(serializers.ModelSerializer):
+	class Meta:
+		model = Item
+		fields = '__all__'
+
+
+class StoreItemReadSerializer(serializers.ModelSerializer):
+	item = ItemFieldsSerializer(read_only=True)
+	location = LocationSerializer(read_only=True)
+
+	class Meta:
+		model = StoreItem
+		fields = ('id', 'item', 'quantity', 'location')
+
+
 class InventoryRecordSerializer(serializers.ModelSerializer):
 	class Meta:
 		model = InventoryRecord
@@ -73,42 +86,48 @@ class InventoryRecordSerializer(serializers.ModelSerializer):
 
 		return validated_data
 
+	def create(self, validated_data):
+		try:
+			return super().create(validated_data)
+		except InsufficientStock as e:
+			raise serializers.ValidationError({'quantity': e.messages})
+
+	def update(self, instance, validated_data):
+		try:
+			return super().update(instance, validated_data)
+		except InsufficientStock as e:
+			raise serializers.ValidationError({'quantity': e.messages})
+
 
 # Customer
 class CustomerSerializer(serializers.ModelSerializer):
 	class Meta:
 		model = Customer
 		fields = ('stripe_customer_id', 'purchase_attempt_time', 'price_level', 'payment_methods')
-	
+		select_related = ('price_level',)
+		prefetch_related = ('payment_methods',)
+
 	def to_representation(self, instance):
 		customer = super().to_representation(instance)
-		customer['price_level'] = instance.price_level.name
-		customer['payment_methods'] = list(instance.payment_methods.all().values_list('name', flat=True))
+		customer['price_level'] = instance.price_level.name if instance.price_level else None
+		customer['payment_methods'] = [method.name for method in instance.payment_methods.all()]
 		return customer
 
 
-class ExtendedUserSerializer(serializers.ModelSerializer):
-	customer = CustomerSerializer(read_only=True)
-	card = CardSerializer(read_only=True, many=True)
-	shipping_address = ShippingAddressSerializer(read_only=True, many=True)
-
+# Order
+class ShippingAddressFieldsSerializer(serializers.ModelSerializer):
 	class Meta:
-		model = User
-		fields = ('id', 'first_name', 'last_name', 'email', 'customer', 'card', 'shipping_address')
-
-	def __init__(self, *args, **kwargs):
-		super().__init__(*args, **kwargs)
-		self.fields['orders'] = OrderSerializer(
-			instance=Order.objects.get_or_create_active(self.instance)[0], read_only=True, many=True
-		)
+		model = ShippingAddress
+		fields = '__all__'
 
 
-# Order
 class OrderItemSerializer(serializers.ModelSerializer):
+	store_item = StoreItemReadSerializer(read_only=True)
+	shipping_address = ShippingAddressFieldsSerializer(read_only=True)
+
 	class Meta:
 		model = OrderItem
 		fields = ('store_item', 'quantity', 'price', 'total', 'shipping_address',)
-		depth = 2
 
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -140,6 +159,23 @@ class OrderSerializer(serializers.ModelSerializer):
 		)
 
 
+# Profile
+# Orders are the user's whole history, placed orders and the cart alike.
+# Reading the profile never creates a cart.
+class ExtendedUserSerializer(serializers.ModelSerializer):
+	customer = CustomerSerializer(read_only=True)
+	card = CardSerializer(read_only=True, many=True)
+	shipping_address = ShippingAddressSerializer(read_only=True, many=True)
+	orders = OrderSerializer(read_only=True, many=True)
+
+	class Meta:
+		model = User
+		fields = ('id', 'first_name', 'last_name', 'email', 'customer', 'card', 'shipping_address', 'orders')
+		prefetch_related = (
+			Prefetch('orders', queryset=apply_query_plan(Order.objects.all(), OrderSerializer)),
+		)
+
+
 # Cart
 class CartSerializer(serializers.Serializer):
 	quantity = serializers.IntegerField()
@@ -181,6 +217,13 @@ class CheckoutSerializer(serializers.Serializer):
 
 	def save(self):
 		self.order.pre_payment(self.validated_data['card'])
-		payment_intent_id = stripe_make_payment(self.order)
-		self.order.make_payment(payment_intent_id)
+		return self.complete(stripe_make_payment(self.order))
+
+	# Marks the order paid, or refunds the charge if the stock ran out meanwhile
+	def complete(self, payment_intent_id):
+		try:
+			self.order.make_payment(payment_intent_id)
+		except InsufficientStock as e:
+			stripe_refund(payment_intent_id)
+			raise serializers.ValidationError(e.messages)
 		return self.order
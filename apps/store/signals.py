@@ -0,0 +1,10 @@
+from django.dispatch import Signal
+
+from common.instrumentation import register_signals
+
+
+# Sent once after open cart lines for store items have been zeroed in bulk.
+# Arguments: store_item_ids, order_ids, count
+carts_invalidated = Signal()
+
+register_signals(carts_invalidated)
@@ -0,0 +1,86 @@
+import threading
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Sum
+from django.test import TransactionTestCase
+from model_bakery import baker
+from rest_framework.serializers import ValidationError
+
+from store.benchmark import fake_stripe
+from store.models import REMOVE, InsufficientStock, InventoryRecord, Order, PaymentMethod, StoreItem
+from store.serializers import CheckoutSerializer
+from store.utils import stripe_make_payment
+from .utils import add_to_cart, make_customer, make_store_item
+
+
+class ConcurrentStockTests(TransactionTestCase):
+	WORKERS = 12
+	STOCK = 5
+
+	def setUp(self):
+		cache.clear()
+		self.store_item = make_store_item(quantity=self.STOCK)
+
+	def run_concurrently(self, func, args_list, errors=(InsufficientStock,)):
+		barrier = threading.Barrier(len(args_list))
+		results = []
+
+		def worker(*args):
+			barrier.wait()
+			try:
+				func(*args)
+				results.append(True)
+			except errors:
+				results.append(False)
+			finally:
+				connection.close()
+
+		threads = [threading.Thread(target=worker, args=args) for args in args_list]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		return results
+
+	def assertStockConserved(self):
+		quantity = StoreItem.objects.get(pk=self.store_item.pk).quantity
+		removed = InventoryRecord.objects.filter(option=REMOVE).aggregate(Sum('quantity'))['quantity__sum'] or 0
+		self.assertGreaterEqual(quantity, 0)
+		self.assertEqual(quantity + removed, self.STOCK)
+
+	def make_checkout(self, i):
+		user = make_customer(email=f'user{i}@email.com')
+		user.customer.payment_methods.add(PaymentMethod.objects.get_or_create(name=PaymentMethod.CREDIT_CARD)[0])
+		add_to_cart(user, self.store_item, 1)
+
+		serializer = CheckoutSerializer(
+			context={'request': SimpleNamespace(user=user)}, data={'card': baker.make('customers.Card', user=user).pk}
+		)
+		serializer.is_valid(raise_exception=True)
+		serializer.order.pre_payment(serializer.validated_data['card'])
+		return serializer, stripe_make_payment(serializer.order)
+
+	# Every customer is charged up front; the race is over who gets the stock
+	def test_checkouts_conserve_stock(self):
+		with fake_stripe() as stripe:
+			checkouts = [self.make_checkout(i) for i in range(self.WORKERS)]
+			results = self.run_concurrently(
+				lambda serializer, payment_intent_id: serializer.complete(payment_intent_id), checkouts,
+				errors=(ValidationError,)
+			)
+
+		self.assertEqual(results.count(True), self.STOCK)
+		self.assertEqual(results.count(False), self.WORKERS - self.STOCK)
+		self.assertEqual(Order.objects.filter(date_paid__isnull=False).count(), self.STOCK)
+		self.assertEqual(stripe.calls.count('Refund.create'), self.WORKERS - self.STOCK)
+		self.assertStockConserved()
+
+	def test_removals_never_oversell(self):
+		record = lambda: InventoryRecord.objects.create(store_item=self.store_item, option=REMOVE, quantity=1)
+		results = self.run_concurrently(record, [()] * self.WORKERS)
+
+		self.assertEqual(results.count(True), self.STOCK)
+		self.assertEqual(results.count(False), self.WORKERS - self.STOCK)
+		self.assertStockConserved()
@@ -0,0 +1,493 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from common.utils import delete_in_batches
+from customers.models import Customer
+from store.models import (
+	ADD,
+	REMOVE,
+	CustomPrice,
+	InsufficientStock,
+	InventoryRecord,
+	Order,
+	OrderItem,
+	Price,
+	PriceResolver,
+	StoreItem,
+	change_stock,
+	collapse_duplicate_carts,
+	get_user_price,
+	get_user_prices,
+	invalidate_open_carts,
+	materialize_prices,
+	post_order_inventory,
+	reconcile_reserved,
+	reprice_open_orders
+)
+from store.signals import carts_invalidated
+from .utils import add_to_cart, make_customer, make_price_level, make_store_item, set_level_price
+
+
+# A single test process shares its local-memory cache with itself
+@override_settings(CACHE_IS_SHARED=True)
+class PriceResolverTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.price_level = make_price_level()
+		self.user = make_customer(self.price_level)
+		self.store_item = make_store_item()
+		self.item = self.store_item.item
+		set_level_price(self.price_level, self.item, 10)
+
+	def test_level_price(self):
+		self.assertEqual(get_user_price(self.user, self.item), 10)
+
+	def test_custom_price_overrides_level_price(self):
+		CustomPrice.objects.create(user=self.user, item=self.item, price=7)
+		self.assertEqual(get_user_price(self.user, self.item), 7)
+
+	def test_cached_price_skips_queries(self):
+		get_user_price(self.user, self.item)
+		with self.assertNumQueries(0):
+			self.assertEqual(get_user_price(self.user, self.item), 10)
+
+	@override_settings(CACHE_IS_SHARED=None)
+	def test_per_process_cache_is_not_used(self):
+		get_user_price(self.user, self.item)
+		self.item.price_set.update(price=12)
+		self.assertEqual(get_user_price(self.user, self.item), 12)
+
+	def test_price_save_invalidates_cache(self):
+		get_user_price(self.user, self.item)
+		set_level_price(self.price_level, self.item, 12)
+		self.assertEqual(get_user_price(self.user, self.item), 12)
+
+	def test_custom_price_delete_invalidates_cache(self):
+		custom_price = CustomPrice.objects.create(user=self.user, item=self.item, price=7)
+		self.assertEqual(get_user_price(self.user, self.item), 7)
+
+		custom_price.delete()
+		self.assertEqual(get_user_price(self.user, self.item), 10)
+
+	def test_price_delete_invalidates_cache(self):
+		get_user_price(self.user, self.item)
+		self.item.price_set.get(price_type__price_level=self.price_level).delete()
+		self.assertEqual(get_user_price(self.user, self.item), 0)
+
+	def test_price_batch_delete_invalidates_cache(self):
+		get_user_price(self.user, self.item)
+		delete_in_batches(self.item.price_set.filter(price_type__price_level=self.price_level))
+		self.assertEqual(get_user_price(self.user, self.item), 0)
+
+	def test_batch_prices_in_one_round_trip(self):
+		items = [self.item] + [make_store_item(item_type=self.item.item_type).item for i in range(3)]
+		with self.assertNumQueries(2):
+			prices = get_user_prices(self.user, items, PriceResolver())
+
+		self.assertEqual(prices[self.item.pk], 10)
+		self.assertEqual(len(prices), 4)
+
+
+class RepriceOpenOrdersTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.price_level = make_price_level()
+		self.store_item = make_store_item()
+		self.item = self.store_item.item
+		set_level_price(self.price_level, self.item, 10)
+
+		self.users = [make_customer(self.price_level, email=f'user{i}@email.com') for i in range(3)]
+		for user in self.users:
+			add_to_cart(user, self.store_item, 2)
+
+	def test_price_edit_reprices_every_cart(self):
+		set_level_price(self.price_level, self.item, 5)
+		for order in Order.objects.all():
+			self.assertEqual(order.subtotal, 10)
+			self.assertAlmostEqual(order.grand_total, 10.7)
+
+	def test_custom_price_only_reprices_its_user(self):
+		CustomPrice.objects.create(user=self.users[0], item=self.item, price=1)
+		self.assertEqual(Order.objects.get(user=self.users[0]).subtotal, 2)
+		self.assertEqual(Order.objects.get(user=self.users[1]).subtotal, 20)
+
+	def test_reprice_reports_touched_rows(self):
+		self.assertEqual(reprice_open_orders(item=self.item), {'order_items': 0, 'orders': 0})
+
+		self.item.price_set.update(price=3)
+		cache.clear()
+		self.assertEqual(reprice_open_orders(item=self.item), {'order_items': 3, 'orders': 3})
+
+	def test_reprice_query_count_is_independent_of_cart_count(self):
+		self.item.price_set.update(price=3)
+		cache.clear()
+		with self.assertNumQueries(7):
+			reprice_open_orders(item=self.item)
+
+
+class MaterializePricesTests(TestCase):
+	def setUp(self):
+		self.price_level = make_price_level()
+		self.shoes = [make_store_item().item]
+		self.shoes += [make_store_item(item_type=self.shoes[0].item_type).item for i in range(2)]
+		self.hat = make_store_item().item
+
+	def test_item_created_gets_price_per_level(self):
+		self.assertEqual(self.hat.price_set.count(), 1)
+		self.assertEqual(self.hat.price_set.get().price_type.item_type, self.hat.item_type)
+
+	def test_price_level_created_only_matching_types(self):
+		price_level = make_price_level('Wholesale')
+		self.assertEqual(Price.objects.filter(price_type__price_level=price_level).count(), 4)
+		self.assertFalse(Price.objects.exclude(price_type__item_type=F('item__item_type')).exists())
+		self.assertEqual(price_level.pricetype_set.count(), 2)
+
+	def test_materialize_is_idempotent_and_reports_progress(self):
+		Price.objects.filter(item=self.hat).delete()
+		calls = []
+		self.assertEqual(materialize_prices(batch_size=1, progress=lambda *args: calls.append(args)), 1)
+		self.assertEqual(calls, [(1, 1)])
+		self.assertEqual(materialize_prices(), 0)
+
+
+class OrderTotalTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.price_level = make_price_level()
+		self.user = make_customer(self.price_level)
+		self.store_items = [make_store_item()]
+		self.store_items += [make_store_item(item_type=self.store_items[0].item.item_type) for i in range(3)]
+		for store_item in self.store_items:
+			set_level_price(self.price_level, store_item.item, 10)
+
+	def get_order(self):
+		return Order.objects.get(user=self.user)
+
+	def test_totals_follow_line_changes(self):
+		order_item = add_to_cart(self.user, self.store_items[0], 2)
+		add_to_cart(self.user, self.store_items[1], 1)
+		self.assertEqual(self.get_order().subtotal, 30)
+
+		order_item.quantity = 1
+		order_item.save()
+		order = self.get_order()
+		self.assertEqual(order.subtotal, 20)
+		self.assertAlmostEqual(order.tax, 1.4)
+		self.assertAlmostEqual(order.grand_total, 21.4)
+
+		order_item.delete()
+		self.assertEqual(self.get_order().subtotal, 10)
+
+	def test_line_save_query_count_is_independent_of_cart_size(self):
+		for store_item in self.store_items[1:]:
+			add_to_cart(self.user, store_item, 1)
+
+		order_item = add_to_cart(self.user, self.store_items[0], 1)
+		order_item.quantity = 3
+		# Two of them read the price, as the local-memory cache isn't shared
+		with self.assertNumQueries(5):
+			order_item.save()
+
+	def test_verify_order_totals_repairs_drift(self):
+		add_to_cart(self.user, self.store_items[0], 2)
+		Order.objects.update(subtotal=5, grand_total=5)
+
+		out = StringIO()
+		call_command('verify_order_totals', active=True, repair=True, stdout=out)
+		self.assertIn('Repaired 1 order(s).', out.getvalue())
+		self.assertAlmostEqual(self.get_order().grand_total, 21.4)
+
+
+class ReservedQuantityTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.store_item = make_store_item(quantity=10)
+		self.users = [make_customer(email=f'user{i}@email.com') for i in range(2)]
+
+	def get_store_item(self):
+		return StoreItem.objects.get(pk=self.store_item.pk)
+
+	def test_cart_lines_reserve_quantity(self):
+		order_item = add_to_cart(self.users[0], self.store_item, 3)
+		add_to_cart(self.users[1], self.store_item, 2)
+		self.assertEqual(self.get_store_item().reserved, 5)
+		self.assertEqual(self.get_store_item().quantity_in_carts(), 5)
+
+		order_item.quantity = 1
+		order_item.save()
+		self.assertEqual(self.get_store_item().reserved, 3)
+
+		order_item.delete()
+		self.assertEqual(self.get_store_item().reserved, 2)
+
+	def test_quantity_in_carts_is_a_single_row_read(self):
+		add_to_cart(self.users[0], self.store_item, 3)
+		store_item = self.get_store_item()
+		with self.assertNumQueries(0):
+			self.assertEqual(store_item.quantity_in_carts(), 7)
+
+	def test_payment_releases_reservation(self):
+		order_item = add_to_cart(self.users[0], self.store_item, 3)
+		order_item.order.make_payment('pi_test')
+
+		store_item = self.get_store_item()
+		self.assertEqual(store_item.reserved, 0)
+		self.assertEqual(store_item.quantity, 7)
+
+	def test_reconcile_reserved(self):
+		add_to_cart(self.users[0], self.store_item, 3)
+		StoreItem.objects.update(reserved=0)
+
+		self.assertEqual(reconcile_reserved(), 1)
+		self.assertEqual(self.get_store_item().reserved, 3)
+		self.assertEqual(reconcile_reserved(), 0)
+
+
+class OrderNumberTests(TestCase):
+	def setUp(self):
+		self.user = make_customer()
+
+	def test_unsaved_order_does_not_query(self):
+		with self.assertNumQueries(0):
+			order = Order(user=self.user)
+		self.assertIsNone(order.number)
+
+	def test_numbers_assigned_on_save(self):
+		first = Order.objects.create(user=self.user, date_ordered=timezone.now())
+		second = Order.objects.create(user=self.user)
+		self.assertEqual(second.number, first.number + 1)
+
+
+class ActiveCartTests(TestCase):
+	def setUp(self):
+		self.user = make_customer()
+		self.store_items = [make_store_item(), make_store_item()]
+
+	def test_one_open_cart_per_user(self):
+		order = Order.objects.get_or_create_active(self.user)[0]
+		with self.assertRaises(IntegrityError), transaction.atomic():
+			Order.objects.create(user=self.user)
+
+		order.date_ordered = timezone.now()
+		order.save()
+		self.assertNotEqual(Order.objects.get_or_create_active(self.user)[0], order)
+
+	def test_collapse_duplicate_carts(self):
+		with connection.cursor() as cursor:
+			cursor.execute('DROP INDEX unique_active_order')
+
+		first, second = Order.objects.create(user=self.user), Order.objects.create(user=self.user)
+		for order, quantities in ((first, (1,)), (second, (2, 3))):
+			for store_item, quantity in zip(self.store_items, quantities):
+				OrderItem.objects.create(order=order, store_item=store_item, quantity=quantity)
+
+		self.assertEqual(collapse_duplicate_carts(), 1)
+		self.assertEqual(list(Order.objects.active()), [first])
+		self.assertEqual(
+			dict(first.orderitem_set.values_list('store_item', 'quantity')),
+			{self.store_items[0].pk: 3, self.store_items[1].pk: 3}
+		)
+		self.assertEqual([item.reserved for item in StoreItem.objects.order_by('pk')], [3, 3])
+		first.refresh_from_db()
+		self.assertEqual(first.subtotal, sum(first.orderitem_set.values_list('total', flat=True)))
+
+
+class InvalidateOpenCartsTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.price_level = make_price_level()
+		self.store_item = make_store_item(quantity=10)
+		set_level_price(self.price_level, self.store_item.item, 10)
+		self.users = [make_customer(self.price_level, email=f'user{i}@email.com') for i in range(3)]
+		for user in self.users:
+			add_to_cart(user, self.store_item, 2)
+
+	def test_remove_record_empties_carts_once(self):
+		events = []
+		def listener(**kwargs):
+			events.append(kwargs)
+		carts_invalidated.connect(listener)
+		self.addCleanup(carts_invalidated.disconnect, listener)
+
+		InventoryRecord.objects.create(store_item=self.store_item, option=REMOVE, quantity=1)
+
+		self.assertEqual(len(events), 1)
+		self.assertEqual(events[0]['count'], 3)
+		self.assertFalse(OrderItem.objects.filter(quantity__gt=0).exists())
+		self.assertFalse(Order.objects.exclude(grand_total=0).exists())
+
+		store_item = StoreItem.objects.get(pk=self.store_item.pk)
+		self.assertEqual((store_item.quantity, store_item.reserved), (9, 0))
+
+	def test_invalidation_query_count_is_independent_of_cart_count(self):
+		with self.assertNumQueries(6):
+			invalidate_open_carts([self.store_item.pk])
+
+
+class PostOrderInventoryTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.user = make_customer()
+		self.other_user = make_customer(email='other@email.com')
+		self.store_items = [make_store_item(quantity=10)]
+		self.store_items += [make_store_item(quantity=10, location=self.store_items[0].location) for i in range(2)]
+
+	def pay(self):
+		order = Order.objects.get_or_create_active(user=self.user)[0]
+		order.make_payment('pi_test')
+		return order
+
+	def test_records_and_stock(self):
+		for i, store_item in enumerate(self.store_items):
+			add_to_cart(self.user, store_item, i+1)
+		order = self.pay()
+
+		records = InventoryRecord.objects.filter(order_item__order=order, option=REMOVE)
+		self.assertEqual(sorted(records.values_list('quantity', flat=True)), [1, 2, 3])
+		self.assertEqual(
+			list(StoreItem.objects.order_by('pk').values_list('quantity', flat=True)), [9, 8, 7]
+		)
+
+	def test_other_open_carts_are_invalidated(self):
+		add_to_cart(self.user, self.store_items[0], 8)
+		other_line = add_to_cart(self.other_user, self.store_items[0], 2)
+		self.pay()
+		self.assertEqual(OrderItem.objects.get(pk=other_line.pk).quantity, 2)
+
+		self.user = self.other_user
+		third_user = make_customer(email='third@email.com')
+		third_line = add_to_cart(third_user, self.store_items[0], 1)
+		self.pay()
+
+		self.assertEqual(OrderItem.objects.get(pk=third_line.pk).quantity, 0)
+		self.assertEqual(StoreItem.objects.get(pk=self.store_items[0].pk).reserved, 0)
+
+	def test_query_count_is_independent_of_line_count(self):
+		for store_item in self.store_items:
+			add_to_cart(self.user, store_item, 1)
+		order = Order.objects.get_or_create_active(user=self.user)[0]
+		Order.objects.filter(pk=order.pk).update(date_ordered=timezone.now())
+
+		with self.assertNumQueries(11):
+			post_order_inventory(order)
+
+
+class ChangeStockTests(TestCase):
+	def setUp(self):
+		self.store_item = make_store_item(quantity=5)
+
+	def get_quantity(self):
+		return StoreItem.objects.get(pk=self.store_item.pk).quantity
+
+	def test_insufficient_stock_changes_nothing(self):
+		other = make_store_item(quantity=5, location=self.store_item.location)
+		with self.assertRaises(InsufficientStock):
+			change_stock({self.store_item.pk: -6, other.pk: -1})
+
+		self.assertEqual(self.get_quantity(), 5)
+		self.assertEqual(StoreItem.objects.get(pk=other.pk).quantity, 5)
+
+	def test_remove_record_over_stock_is_rolled_back(self):
+		with self.assertRaises(InsufficientStock):
+			InventoryRecord.objects.create(store_item=self.store_item, option=REMOVE, quantity=6)
+
+		self.assertFalse(InventoryRecord.objects.exists())
+		self.assertEqual(self.get_quantity(), 5)
+
+	def test_record_delete_reverses_stock(self):
+		record = InventoryRecord.objects.create(store_item=self.store_item, option=ADD, quantity=3)
+		self.assertEqual(self.get_quantity(), 8)
+
+		record.delete()
+		self.assertEqual(self.get_quantity(), 5)
+
+
+class DeleteInBatchesTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.price_level = make_price_level()
+		self.store_item = make_store_item(quantity=0)
+		set_level_price(self.price_level, self.store_item.item, 10)
+
+	def add_records(self, count):
+		InventoryRecord.objects.bulk_create(
+			[InventoryRecord(store_item=self.store_item, option=ADD, quantity=2) for i in range(count)]
+		)
+		StoreItem.objects.filter(pk=self.store_item.pk).update(quantity=2 * count)
+
+	def test_records_reverse_stock_per_batch(self):
+		self.add_records(5)
+		progress = []
+		deleted = delete_in_batches(
+			InventoryRecord.objects.all(), batch_size=2, progress=lambda *args: progress.append(args[:2])
+		)
+
+		self.assertEqual(deleted['store.InventoryRecord'], 5)
+		self.assertEqual(progress, [(2, 5), (4, 5), (5, 5)])
+		self.assertEqual(StoreItem.objects.get(pk=self.store_item.pk).quantity, 0)
+
+	def test_query_count_is_independent_of_record_count(self):
+		def count_queries(records):
+			self.add_records(records)
+			with CaptureQueriesContext(connection) as context:
+				delete_in_batches(InventoryRecord.objects.all(), batch_size=100)
+			return len(context.captured_queries)
+
+		self.assertEqual(count_queries(2), count_queries(20))
+
+	def test_store_item_delete_updates_carts(self):
+		other = make_store_item(quantity=10, location=self.store_item.location)
+		set_level_price(self.price_level, other.item, 5)
+		user = make_customer(self.price_level)
+		add_to_cart(user, other, 2)
+		StoreItem.objects.filter(pk=self.store_item.pk).update(quantity=10)
+		add_to_cart(user, self.store_item, 1)
+
+		deleted = delete_in_batches(StoreItem.objects.filter(pk=self.store_item.pk))
+
+		self.assertEqual(deleted['store.StoreItem'], 1)
+		self.assertEqual(deleted['store.OrderItem'], 1)
+		order = Order.objects.get(user=user)
+		self.assertEqual(order.subtotal, 10)
+		self.assertEqual(StoreItem.objects.get(pk=other.pk).reserved, 2)
+
+
+class TrackedFieldsTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.price_levels = [make_price_level('Retail'), make_price_level('Bulk')]
+		for i in range(5):
+			make_customer(self.price_levels[0], email=f'user{i}@email.com')
+
+	def test_loading_customers_runs_one_query(self):
+		with self.assertNumQueries(1):
+			customers = list(Customer.objects.all())
+		self.assertFalse(any(customer.has_changed('price_level') for customer in customers))
+
+	def test_price_level_change_reprices_cart(self):
+		store_item = make_store_item()
+		set_level_price(self.price_levels[0], store_item.item, 10)
+		set_level_price(self.price_levels[1], store_item.item, 8)
+		customer = Customer.objects.select_related('user').first()
+		order_item = add_to_cart(customer.user, store_item, 2)
+
+		customer.price_level = self.price_levels[1]
+		customer.save()
+
+		self.assertFalse(customer.has_changed('price_level'))
+		self.assertEqual(OrderItem.objects.get(pk=order_item.pk).total, 16)
+
+	def test_order_item_tracking_resets_after_save(self):
+		order_item = add_to_cart(Customer.objects.first().user, make_store_item(), 2)
+		self.assertEqual(order_item.init_quantity, 2)
+
+		order_item = OrderItem.objects.get(pk=order_item.pk)
+		order_item.quantity = 3
+		self.assertEqual(order_item.quantity_dif(), 1)
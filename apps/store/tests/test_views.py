@@ -0,0 +1,343 @@
+import json
+import os
+import tempfile
+from base64 import urlsafe_b64encode
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from model_bakery import baker
+
+from catalog.models import SearchTerm
+from common.instrumentation import QueryBudgetExceeded, instrument, query_metrics
+from common.serializers import ValuesSerializer
+from common.utils import CompactJsonRenderer
+from store.models import Order, OrderItem, StoreItem, change_stock
+from store.serializers import OrderItemSerializer, StoreItemReadSerializer
+from store.views import StoreItemBulkView
+from .utils import add_to_cart, make_customer, make_price_level, make_store_item
+
+
+class StoreItemListTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.client.force_authenticate(baker.make('users.User', email='ryu@email.com'))
+		self.location = baker.make('store.Location', country='US')
+
+	def add_store_items(self, count):
+		for i in range(count):
+			make_store_item(location=self.location, name=f'Shoe {StoreItem.objects.count()}')
+
+	def count_get_queries(self):
+		with CaptureQueriesContext(connection) as context:
+			response = self.client.get('/store/')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		return len(context)
+
+	def test_query_count_is_fixed(self):
+		self.add_store_items(2)
+		small = self.count_get_queries()
+		self.add_store_items(10)
+		self.assertEqual(self.count_get_queries(), small)
+
+	def test_list_nests_item_and_location(self):
+		self.add_store_items(1)
+		row = self.client.get('/store/').data['results'][0]
+
+		self.assertEqual(row['item']['name'], 'Shoe 0')
+		self.assertEqual(row['location']['id'], self.location.pk)
+
+	def test_values_output_matches_serializer(self):
+		self.add_store_items(3)
+		StoreItem.objects.filter(pk=StoreItem.objects.first().pk).update(quantity=0)
+		qs = StoreItem.objects.order_by('pk')
+		serializer = ValuesSerializer.for_serializer(StoreItemReadSerializer)
+
+		renderer = CompactJsonRenderer()
+		fast = renderer.render([serializer.to_representation(row) for row in serializer.values(qs)])
+		self.assertEqual(fast, renderer.render(StoreItemReadSerializer(qs, many=True).data))
+
+	def test_benchmark_outputs_match_and_roll_back(self):
+		out = StringIO()
+		call_command('benchmark_serializers', rows=50, stdout=out)
+
+		self.assertNotIn('differ', out.getvalue())
+		self.assertFalse(StoreItem.objects.exists())
+
+	def test_reads_do_not_change_write_serializer(self):
+		self.add_store_items(1)
+		self.client.get('/store/')
+
+		item = baker.make('catalog.Item')
+		location = {
+			'name': self.location.name, 'line1': '1 Main St', 'city': 'New York', 'state': 'NY', 'zipcode': '10001', 'country': 'US'
+		}
+		response = self.client.post('/store/', data=[{'item': item.pk, 'location': location}], format='json')
+		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+		self.assertEqual(response.data[0]['item'], item.pk)
+
+	def test_bulk_update_is_not_exposed(self):
+		response = self.client.patch('/store/', data=[], format='json')
+		self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class StoreItemFacetTests(TestCase):
+	def setUp(self):
+		self.client = APIClient()
+		self.client.force_authenticate(baker.make('users.User', email='ryu@email.com'))
+		self.locations = [baker.make('store.Location', country='US') for i in range(2)]
+		shoes = baker.make('catalog.ItemType', name='Shoes')
+		hats = baker.make('catalog.ItemType', name='Hats')
+		make_store_item(quantity=5, location=self.locations[0], item_type=shoes, name='Runner')
+		make_store_item(quantity=0, location=self.locations[1], item_type=shoes, name='Racer')
+		make_store_item(quantity=2, location=self.locations[1], item_type=hats, name='Wool Hat')
+
+	def get_facets(self, query='', queries=1):
+		with self.assertNumQueries(queries):
+			response = self.client.get(f'/store/?facets=1&{query}')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		return {name: {entry['id']: entry['count'] for entry in entries} for name, entries in response.data.items()}
+
+	def test_counts_per_facet(self):
+		facets = self.get_facets()
+
+		self.assertEqual(sorted(facets['item_type'].values()), [1, 2])
+		self.assertEqual(facets['location'], {self.locations[0].pk: 1, self.locations[1].pk: 2})
+		self.assertEqual(facets['in_stock'], {True: 2, False: 1})
+
+	def test_counts_follow_filters(self):
+		# One more query to expand the search token; ranking runs inside the filtered query
+		facets = self.get_facets('type=shoes&q=ra', queries=2)
+		self.assertEqual(facets['in_stock'], {False: 1})
+
+
+class OrderListTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.price_level = make_price_level()
+		self.user = make_customer(self.price_level)
+		self.client = APIClient()
+		self.client.force_authenticate(self.user)
+		self.location = baker.make('store.Location', country='US')
+
+	def place_order(self, lines):
+		for i in range(lines):
+			add_to_cart(self.user, make_store_item(location=self.location), 1)
+		Order.objects.filter(user=self.user, date_ordered__isnull=True).update(date_ordered=timezone.now())
+
+	def count_get_queries(self):
+		with CaptureQueriesContext(connection) as context:
+			response = self.client.get('/store/orders/')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		return len(context)
+
+	def test_query_count_is_fixed(self):
+		self.place_order(1)
+		small = self.count_get_queries()
+		self.place_order(5)
+		self.place_order(3)
+		self.assertEqual(self.count_get_queries(), small)
+
+	# The line's address is flat, with its user as a pk rather than nested
+	def test_shipping_address_shape(self):
+		self.place_order(1)
+		address = baker.make('customers.ShippingAddress', user=self.user, country='US')
+		OrderItem.objects.update(shipping_address=address)
+
+		line = self.client.get('/store/orders/').data['results'][0]['orderitem_set'][0]
+		self.assertEqual(set(line['shipping_address']), {
+			'id', 'first_name', 'last_name', 'email', 'line1', 'line2', 'city', 'state', 'zipcode', 'country', 'user'
+		})
+		self.assertEqual(line['shipping_address']['user'], self.user.pk)
+
+	def test_cursor_of_the_wrong_type(self):
+		self.place_order(1)
+		cursor = urlsafe_b64encode(json.dumps(['abc']).encode()).decode()
+		response = self.client.get(f'/store/orders/?cursor={cursor}')
+		self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+# A single test process shares its local-memory cache with itself
+@override_settings(CACHE_IS_SHARED=True)
+class ProfileTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.price_level = make_price_level()
+		self.user = make_customer(self.price_level)
+		self.client = APIClient()
+		self.client.force_authenticate(self.user)
+		self.location = baker.make('store.Location', country='US')
+
+	def get_profile(self):
+		response = self.client.get('/store/user/')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		return response.data
+
+	def test_reading_does_not_create_a_cart(self):
+		self.assertEqual(self.get_profile()['orders'], [])
+		self.assertFalse(Order.objects.filter(user=self.user).exists())
+
+	def test_placed_orders_are_listed(self):
+		for i in range(2):
+			add_to_cart(self.user, make_store_item(location=self.location), 1)
+			Order.objects.filter(user=self.user, date_ordered__isnull=True).update(date_ordered=timezone.now())
+
+		orders = self.get_profile()['orders']
+		self.assertEqual(len(orders), 2)
+		self.assertTrue(all(order['date_ordered'] for order in orders))
+		self.assertEqual(Order.objects.filter(user=self.user).count(), 2)
+
+	def test_query_count_is_fixed(self):
+		add_to_cart(self.user, make_store_item(location=self.location), 1)
+		baker.make('customers.Card', user=self.user, _quantity=2)
+		baker.make('customers.ShippingAddress', user=self.user, _quantity=2)
+		for i in range(3):
+			add_to_cart(self.user, make_store_item(location=self.location), 1)
+
+		cache.clear()
+		with self.assertNumQueries(6):
+			profile = self.get_profile()
+		self.assertEqual(len(profile['orders']), 1)
+		self.assertEqual(len(profile['orders'][0]['orderitem_set']), 4)
+		self.assertEqual(len(profile['card']), 2)
+		self.assertEqual(profile['customer']['price_level'], 'Retail')
+
+	def test_cached_until_changed(self):
+		self.get_profile()
+		with self.assertNumQueries(0):
+			self.get_profile()
+
+		add_to_cart(self.user, make_store_item(location=self.location), 2)
+		self.assertEqual(self.get_profile()['orders'][0]['orderitem_set'][0]['quantity'], 2)
+
+		baker.make('customers.ShippingAddress', user=self.user)
+		self.assertEqual(len(self.get_profile()['shipping_address']), 1)
+
+		self.price_level.name = 'Wholesale'
+		self.price_level.save()
+		self.assertEqual(self.get_profile()['customer']['price_level'], 'Wholesale')
+
+	def test_other_users_stay_cached(self):
+		self.get_profile()
+		other = make_customer(email='ken@email.com')
+		add_to_cart(other, make_store_item(location=self.location), 1)
+		with self.assertNumQueries(0):
+			self.get_profile()
+
+	def test_stock_changes_reach_carts_holding_the_item(self):
+		store_item = make_store_item(quantity=5, location=self.location)
+		add_to_cart(self.user, store_item, 1)
+		self.get_profile()
+
+		change_stock({store_item.pk: -2})
+		self.assertEqual(self.get_profile()['orders'][0]['orderitem_set'][0]['store_item']['quantity'], 3)
+
+	@override_settings(CACHE_IS_SHARED=None)
+	def test_per_process_cache_is_not_used(self):
+		self.get_profile()
+		baker.make('customers.ShippingAddress', user=self.user)
+		self.assertEqual(len(self.get_profile()['shipping_address']), 1)
+
+
+class QueryInstrumentationTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.user = make_customer(make_price_level())
+		self.location = baker.make('store.Location', country='US')
+		self.client = APIClient()
+		self.client.force_authenticate(self.user)
+
+	def test_queries_are_reported_per_receiver(self):
+		store_item = make_store_item(location=self.location)
+		with instrument() as stats:
+			add_to_cart(self.user, store_item, 2)
+
+		self.assertGreater(stats.count, 0)
+		self.assertIn('store.models.update_total', stats.receivers)
+
+	def test_repeated_queries_point_at_serializer_field(self):
+		for i in range(6):
+			add_to_cart(self.user, make_store_item(location=self.location), 1)
+
+		with instrument() as stats:
+			OrderItemSerializer(OrderItem.objects.all(), many=True).data
+
+		origins = {duplicate['origin'] for duplicate in stats.duplicates()}
+		self.assertIn('OrderItemSerializer.store_item', origins)
+
+	def test_headers_and_metrics(self):
+		query_metrics.reset()
+		response = self.client.get('/store/')
+
+		self.assertEqual(response['X-Query-Count'], '1')
+		self.assertEqual(query_metrics.snapshot()[response.wsgi_request.resolver_match.view_name]['requests'], 1)
+		self.assertEqual(self.client.get('/metrics/queries/').status_code, status.HTTP_403_FORBIDDEN)
+
+	def test_authentication_is_not_counted(self):
+		session = APIClient()
+		session.force_login(self.user)
+		jwt = APIClient(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+		counts = []
+		for client in (self.client, session, jwt):
+			cache.clear()
+			response = client.get('/store/user/')
+			self.assertEqual(response.status_code, status.HTTP_200_OK)
+			counts.append(response['X-Query-Count'])
+		self.assertEqual(counts, ['5', '5', '5'])
+
+	def test_budget_only_logs_by_default(self):
+		make_store_item(location=self.location)
+		budget = StoreItemBulkView.query_budget
+		StoreItemBulkView.query_budget = {'GET': 0}
+		self.addCleanup(setattr, StoreItemBulkView, 'query_budget', budget)
+
+		with self.assertLogs('common.middleware', 'WARNING'):
+			self.assertEqual(self.client.get('/store/').status_code, status.HTTP_200_OK)
+
+	@override_settings(QUERY_BUDGET_RAISE=True)
+	def test_budget_is_enforced(self):
+		make_store_item(location=self.location)
+		budget = StoreItemBulkView.query_budget
+		StoreItemBulkView.query_budget = {'GET': 0}
+		self.addCleanup(setattr, StoreItemBulkView, 'query_budget', budget)
+
+		with self.assertRaises(QueryBudgetExceeded):
+			self.client.get('/store/')
+
+
+class BenchmarkTests(TestCase):
+	def test_scenarios_run_offline(self):
+		call_command('seed_benchmark', users=2, items=10, locations=1, price_levels=1, item_types=2, stdout=StringIO())
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		baseline = os.path.join(directory.name, 'baseline.json')
+
+		out = StringIO()
+		call_command('run_benchmark', requests=4, users=2, stripe_latency=0, baseline=baseline, save=True, stdout=out)
+
+		with open(baseline) as f:
+			results = json.load(f)
+		self.assertEqual(set(results), {'browse', 'filter', 'cart', 'checkout'})
+		self.assertFalse(any(result['errors'] for result in results.values()), out.getvalue())
+		self.assertEqual(Order.objects.filter(date_paid__isnull=False).count(), 4)
+
+	def test_reseeding(self):
+		seed = lambda **kwargs: call_command(
+			'seed_benchmark', users=1, items=3, locations=1, price_levels=1, item_types=1, stdout=StringIO(), **kwargs
+		)
+		seed()
+		with self.assertRaises(CommandError):
+			seed()
+		seed(reset=True)
+
+		self.assertEqual(StoreItem.objects.count(), 3)
+		self.assertTrue(SearchTerm.objects.filter(item__name='Bench Item 0', term='bench').exists())
@@ -0,0 +1,37 @@
+from model_bakery import baker
+
+from customers.models import Customer
+from store.models import Order, OrderItem, PriceLevel, StoreItem
+
+
+def make_price_level(name='Retail'):
+	return PriceLevel.objects.create(name=name)
+
+
+def make_customer(price_level=None, email='chun@email.com'):
+	user = baker.make('users.User', email=email)
+	customer = Customer.objects.get_or_create(user=user)[0]
+	customer.price_level = price_level
+	customer.save()
+	return user
+
+
+def make_store_item(quantity=10, location=None, **kwargs):
+	item = baker.make('catalog.Item', **kwargs)
+	location = location or baker.make('store.Location', country='US')
+	return StoreItem.objects.create(item=item, location=location, quantity=quantity)
+
+
+def set_level_price(price_level, item, price):
+	level_price = item.price_set.get(price_type__price_level=price_level)
+	level_price.price = price
+	level_price.save()
+	return level_price
+
+
+def add_to_cart(user, store_item, quantity):
+	order = Order.objects.get_or_create_active(user=user)[0]
+	order_item = OrderItem.objects.get_or_create(order=order, store_item=store_item)[0]
+	order_item.quantity = quantity
+	order_item.save()
+	return order_item
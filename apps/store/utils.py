@@ -25,11 +25,10 @@ def stripe_make_payment(order):
 	return payment_intent_id
 
 
-# def stripe_refund(order):
-# 	if order.payment_intent_id:
-# 		stripe.Refund.create(
-# 			payment_intent=order.payment_intent_id,
-# 		)
+def stripe_refund(payment_intent_id):
+	stripe.Refund.create(
+		payment_intent=payment_intent_id,
+	)
 
 
 # def stripe_partial_charge(order, refund_amt):
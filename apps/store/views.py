@@ -1,7 +1,14 @@
+from django.core.cache import cache
+from django.db.models import BooleanField, Case, F, Value, When
 from django.shortcuts import get_object_or_404
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from common.pagination import KeysetPagination
+from common.serializers import apply_query_plan
+from common.utils import cache_is_shared, count_facets
+from catalog.models import catalog_version
+from catalog.search import search_query_count
 from common.views import BulkAPIView
 from .filters import filter_store_items
 from .models import *
@@ -10,10 +17,22 @@ from .serializers import *
 
 class UserView(APIView):
 	http_method_names = ['get']
+	query_budget = {'GET': 6}
+
+	def get_data(self, request):
+		user = apply_query_plan(User.objects.filter(pk=request.user.pk), ExtendedUserSerializer).get()
+		return ExtendedUserSerializer(instance=user).data
 
 	def get(self, request, *args, **kwargs):
-		serializer = ExtendedUserSerializer(instance=request.user)
-		return Response(serializer.data)
+		if not cache_is_shared():
+			return Response(self.get_data(request))
+
+		key = profile_key(request.user.pk)
+		data = cache.get(key)
+		if data is None:
+			data = self.get_data(request)
+			cache.set(key, data, PROFILE_CACHE_TIMEOUT)
+		return Response(data)
 
 
 class StoreItemBulkView(BulkAPIView):
@@ -22,11 +41,32 @@ class StoreItemBulkView(BulkAPIView):
 
 	queryset = StoreItem.objects.all()
 	serializer_class = StoreItemSerializer
+	read_serializer_class = StoreItemReadSerializer
+	values_read = True
+	query_budget = {'GET': 4}
+	cache_version = catalog_version
 	http_method_names = ['get', 'post', 'delete']
 
 	def get_queryset(self):
 		qs = super().get_queryset()
 		return filter_store_items(qs, self.request.GET)
+
+	# Search runs its token expansion queries before the list query
+	@classmethod
+	def get_query_budget(cls, request):
+		budget = cls.query_budget.get(request.method)
+		if budget is not None and request.GET.get('q'):
+			budget += search_query_count(request.GET['q'])
+		return budget
+
+	def get_facets(self, queryset):
+		in_stock = Case(When(quantity__gt=F('reserved'), then=Value(True)), default=Value(False), output_field=BooleanField())
+		return count_facets(queryset.annotate(in_stock=in_stock), {
+			'item_type': ('item__item_type_id', 'item__item_type__name'),
+			'item_category': ('item__item_category_id', 'item__item_category__name'),
+			'location': ('location_id', 'location__name'),
+			'in_stock': ('in_stock', None),
+		})
 		
 
 class InventoryRecordBulkView(BulkAPIView):
@@ -39,6 +79,8 @@ class InventoryRecordBulkView(BulkAPIView):
 
 
 class OrderView(APIView):
+	query_budget = {'GET': 5}
+
 	def get(self, request, *args, **kwargs):
 		date = request.GET.get('date')
 		user = request.user
@@ -51,8 +93,11 @@ class OrderView(APIView):
 		elif date == 'cancelled':
 			qs = Order.objects.cancelled(user=user)
 
-		result = OrderSerializer(qs, many=many).data
-		return Response(result)
+		paginator = KeysetPagination()
+		qs = apply_query_plan(qs.order_by('-pk'), OrderSerializer)
+		page = paginator.paginate_queryset(qs, request, view=self)
+		result = OrderSerializer(page, many=many).data
+		return paginator.get_paginated_response(result)
 
 
 class CartView(APIView):
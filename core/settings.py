@@ -67,6 +67,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'common.middleware.QueryCountMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'admin_reorder.middleware.ModelAdminReorder',
@@ -75,6 +76,12 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'core.urls'
 
+# Raise instead of logging when a view goes over its query_budget. Off by
+# default; tests opt in with override_settings.
+QUERY_BUDGET_RAISE = False
+# Walks the stack of every query to attribute it to a receiver or serializer field
+QUERY_TRACE_ORIGINS = False
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -104,6 +111,21 @@ DATABASES = {
 }
 
 
+# Cache
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ecommerce-api',
+    }
+}
+
+# List response caching, its ETags and warm_catalog_cache need a cache that
+# every worker shares, so they're off with the local-memory backend above.
+# Point CACHES at e.g. Redis or Memcached, or set this for a single process.
+CACHE_IS_SHARED = None
+
+
 # Password validation
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -139,18 +161,20 @@ USE_TZ = True
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'common.authentication.SessionAuthentication',
+        'common.authentication.JWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES':(
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_RENDERER_CLASSES': (
+        'common.utils.CompactJsonRenderer',
         'common.utils.PrettyJsonRenderer',
+        'common.utils.StreamingJsonRenderer',
     ),
     'DEFAULT_PARSER_CLASSES': (
         'rest_framework.parsers.JSONParser',
-    )
+    ),
 }
 
 SIMPLE_JWT = {
@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.urls import include, path
 
+from common.views import QueryMetricsView
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -9,4 +11,6 @@ urlpatterns = [
     path('catalog/', include('catalog.urls')),
     path('customers/', include('customers.urls')),
     path('store/', include('store.urls')),
+
+    path('metrics/queries/', QueryMetricsView.as_view()),
 ]
\ No newline at end of file